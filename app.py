@@ -1,14 +1,23 @@
 import os
-import re
+import io
 from datetime import date
 import pandas as pd
 import streamlit as st
 
-from build_pdf import build_pdf_from_payload
+from build_pdf import build_pdf_from_payload, build_pdf_bytes
+from output_store import OutputStore, sanitize_filename_component
+from bulk import parse_bulk_csv, build_zip, template_csv, DEFAULT_WORKERS
+from prerender import start_background as start_prerender_scheduler
+from job_queue import JobQueue
+from gate import default_gate, GateBusy
 
 APP_TITLE = "金運の神様占い｜鑑定書メーカー（入力フォーム）"
 DEFAULT_OUTPUT_DIR = "outputs"
 DEFAULT_CSV_PATH = os.path.join("data", "gods.csv")
+# 設定するとその場で生成せず、共有ジョブキュー（job_queue.py のワーカー）に回す
+JOB_QUEUE_PATH = os.environ.get("KAMI_JOB_QUEUE")
+QUEUE_PRIORITY = 10          # 画面からの依頼は一括処理より先に
+QUEUE_WAIT_SECONDS = 180
 
 ROLE_ORDER = ["tenmei", "syukumei", "shimei", "unmei"]
 ROLE_LABELS = {"tenmei": "天命", "syukumei": "宿命", "shimei": "使命", "unmei": "運命"}
@@ -16,14 +25,6 @@ ROLE_LABELS = {"tenmei": "天命", "syukumei": "宿命", "shimei": "使命", "un
 def ensure_dir(path: str) -> None:
     os.makedirs(path, exist_ok=True)
 
-def sanitize_filename_component(text: str) -> str:
-    if text is None:
-        return ""
-    text = text.strip()
-    text = re.sub(r'[\\/:*?"<>|]+', "_", text)
-    text = re.sub(r"_+", "_", text)
-    return text
-
 def make_base_filename(client_name: str, created: date) -> str:
     yy = f"{created.year % 100:02d}"
     mm = f"{created.month:02d}"
@@ -31,19 +32,6 @@ def make_base_filename(client_name: str, created: date) -> str:
     safe_name = sanitize_filename_component(client_name) or "noname"
     return f"鑑定書_{safe_name}_{yy}{mm}{dd}.pdf"
 
-def uniquify_path(directory: str, filename: str) -> str:
-    base, ext = os.path.splitext(filename)
-    candidate = os.path.join(directory, filename)
-    if not os.path.exists(candidate):
-        return candidate
-    i = 1
-    while True:
-        cand_name = f"{base}({i}){ext}"
-        candidate = os.path.join(directory, cand_name)
-        if not os.path.exists(candidate):
-            return candidate
-        i += 1
-
 def load_gods_csv(path: str) -> pd.DataFrame:
     df = pd.read_csv(path)
     df.columns = [c.strip() for c in df.columns]
@@ -59,7 +47,30 @@ def load_gods_csv(path: str) -> pd.DataFrame:
     df["label"] = df.apply(lambda r: f'{r["kami_no"]} {r["name_kanji"]}（{r["name_kana"]}）', axis=1)
     return df.sort_values("kami_no").reset_index(drop=True)
 
+@st.cache_data(max_entries=32, show_spinner=False)
+def render_preview(payload: dict) -> bytes:
+    """個人化ページだけのプレビューPDF（同じ入力なら再生成しない）"""
+    result, _timings = default_gate().run(build_pdf_bytes, {**payload, "preview": True, "linearize": False})
+    return result
+
+def show_pdf(pdf_bytes: bytes, height: int = 620) -> None:
+    """st.pdf で表示する（requirements.txt の streamlit[pdf] が必要）"""
+    try:
+        st.pdf(pdf_bytes, height=height)
+    except Exception as e:
+        # 表示できない環境でも中身は確認できるようにダウンロードを出す
+        print(f"⚠ st.pdf error: {e}")
+        st.info("この環境ではプレビューを表示できません（pip install \"streamlit[pdf]\"）。ダウンロードして確認してください。")
+        st.download_button("プレビューPDFをダウンロード", data=pdf_bytes, file_name="プレビュー.pdf",
+                           mime="application/pdf", key="preview_download")
+
+@st.cache_resource(show_spinner=False)
+def start_prerender():
+    """時期で決まるおまけページの作り置きを、サーバーに1つだけ常駐させる"""
+    return start_prerender_scheduler()
+
 st.set_page_config(page_title=APP_TITLE, layout="centered")
+start_prerender()
 st.title(APP_TITLE)
 
 #with st.sidebar:
@@ -70,6 +81,7 @@ st.title(APP_TITLE)
 
 with st.sidebar:
     st.header("設定")
+    app_mode = st.radio("作成方法", ["1件ずつ（フォーム）", "一括（CSVアップロード）"])
     demo_mode = st.toggle("デモモード（先生用）", value=True)
 
     if demo_mode:
@@ -93,6 +105,59 @@ except Exception as e:
 labels = gods_df["label"].tolist()
 label_to_no = dict(zip(labels, gods_df["kami_no"].tolist()))
 
+#---------------------------------------------------------
+# 一括作成（CSV → ZIP）
+#---------------------------------------------------------
+if app_mode == "一括（CSVアップロード）":
+    st.subheader("CSVから一括作成")
+    st.caption("列：鑑定士名, クライアント名, 誕生日(YYYY-MM-DD), 天命, 宿命, 使命, 運命（神様番号）, "
+               "おまけ, 講座案内, Web最適化（1/0・省略時はフォームの初期値）")
+    st.download_button("CSVのひな形をダウンロード", data=template_csv(),
+                       file_name="鑑定書_一括_ひな形.csv", mime="text/csv")
+
+    uploaded = st.file_uploader("クライアント一覧CSV", type=["csv"])
+    if uploaded is None:
+        st.stop()
+
+    created = date.today()
+    bulk_payloads, bulk_errors = parse_bulk_csv(uploaded.getvalue(),
+                                                set(gods_df["kami_no"].tolist()), created)
+    if bulk_errors:
+        st.error(f"入力エラーが {len(bulk_errors)} 件あります。CSVを直すか、エラーの行を飛ばして作成してください。")
+        st.dataframe(pd.DataFrame(bulk_errors, columns=["行", "内容"]), hide_index=True)
+    st.caption(f"作成できる行: {len(bulk_payloads)} 件")
+    if bulk_payloads:
+        st.dataframe(pd.DataFrame([{"行": p["_line"], "ファイル名": p["_zip_name"], "鑑定士": p["reader_name"],
+                                    "誕生日": p["birthday"]} for p in bulk_payloads]), hide_index=True)
+
+    skip_errors = st.checkbox("エラーの行を飛ばして作成する", value=False, disabled=not bulk_errors)
+    workers = st.slider("同時に作成する数", min_value=1, max_value=max(DEFAULT_WORKERS, 8), value=DEFAULT_WORKERS)
+
+    if st.button("ZIPを作成", type="primary",
+                 disabled=not bulk_payloads or (bool(bulk_errors) and not skip_errors)):
+        progress = st.progress(0.0, text="作成を始めています...")
+
+        def on_progress(done, total, name):
+            progress.progress(done / total, text=f"{done}/{total} 件 … {name}")
+
+        zip_buf = io.BytesIO()
+        try:
+            failures = build_zip(bulk_payloads, zip_buf, workers, on_progress)
+        except Exception as e:
+            st.error(f"ZIPの作成に失敗しました: {e}")
+            st.stop()
+        if failures:
+            st.warning(f"{len(failures)} 件の作成に失敗しました（ZIP内の エラー.txt を参照）")
+            st.dataframe(pd.DataFrame(failures, columns=["行", "内容"]), hide_index=True)
+        st.success(f"{len(bulk_payloads) - len(failures)} 件のPDFを作成しました。")
+        st.download_button(
+            label="ZIPをダウンロード",
+            data=zip_buf.getvalue(),
+            file_name=f"鑑定書_{created:%y%m%d}_{len(bulk_payloads) - len(failures)}件.zip",
+            mime="application/zip",
+        )
+    st.stop()
+
 st.subheader("基本情報")
 reader_name = st.text_input("鑑定士名", value="")
 client_name = st.text_input("クライアント名", value="")
@@ -124,19 +189,22 @@ selected_no = {role: int(label_to_no[selected[role]]) for role in ROLE_ORDER}
 st.subheader("オプション")
 include_bonus = st.checkbox("おまけページを付ける（運勢・年/月の神様など）", value=True)
 include_course = st.checkbox("講座案内・プレゼントページを付ける（講座のお知らせ等）", value=False)
+linearize = st.checkbox("Web表示用に最適化する（スマホで1ページ目を先に表示。生成時のメモリは増える）", value=False)
 
 st.subheader("出力")
 created = date.today()
 
 if demo_mode:
-    st.caption("デモモード：保存先は自動生成（UUID）です。")
+    st.caption("デモモード：保存先は outputs/年/月/日/ に自動生成（同名は連番）です。")
 else:
     base_filename = make_base_filename(client_name or "noname", created)
     filename = st.text_input("保存ファイル名（初期値は作成日ベース）", value=base_filename)
+    # フォルダ区切りなどはファイル名に使えないので置き換える
+    filename = sanitize_filename_component(filename) or base_filename
 
     ensure_dir(output_dir)
-    final_path = uniquify_path(output_dir, filename)
-    st.caption(f"保存先（同名があれば自動で(1)…付与）: {final_path}")
+    store = OutputStore(output_dir)
+    st.caption(f"保存先（日付フォルダに保存・同名があれば自動で(1)…付与）: {store.peek(filename, created)}")
 
 def validate():
     if not reader_name.strip():
@@ -151,8 +219,8 @@ err = validate()
 if err:
     st.warning(err)
 
-if st.button("鑑定書PDF生成", type="primary", disabled=bool(err)):
-    payload = {
+def make_payload() -> dict:
+    return {
         "reader_name": reader_name.strip(),
         "client_name": client_name.strip(),
         "birthday": birthday.isoformat(),
@@ -162,18 +230,64 @@ if st.button("鑑定書PDF生成", type="primary", disabled=bool(err)):
         "unmei": selected_no["unmei"],
         "include_bonus": bool(include_bonus),
         "include_course": bool(include_course),
+        "linearize": bool(linearize),
         "created": created.isoformat(),
     }
-    if not demo_mode:
-        payload["output_pdf_path"] = final_path
 
-    with st.spinner("PDFを生成しています..."):
+st.subheader("プレビュー")
+show_preview = st.toggle("入力に合わせてプレビューを更新（表紙・2・11・29ページのみ／低解像度）", value=True)
+if show_preview and not err:
+    try:
+        show_pdf(render_preview(make_payload()))
+    except GateBusy as e:
+        st.info(f"混み合っているためプレビューを省略しました（{e.retry_after}秒ほどで再表示できます）。")
+    except Exception as e:
+        st.error(f"プレビューの生成に失敗しました: {e}")
+elif show_preview:
+    st.caption("入力がそろうとプレビューを表示します。")
+
+st.caption("名前の位置と神様の選択を確認してから、本番PDFを生成してください。")
+
+if st.button("鑑定書PDF生成", type="primary", disabled=bool(err)):
+    payload = make_payload()
+    if not demo_mode:
+        # 押した時点で排他確保（別セッションと同じパスにならない）
         try:
-            out_pdf_path = build_pdf_from_payload(payload)
-        except Exception as e:
-            st.error(f"PDF生成に失敗しました: {e}")
+            payload["output_pdf_path"] = store.reserve(filename, created)
+        except OSError as e:
+            st.error(f"保存先を確保できませんでした: {e}")
             st.stop()
 
+    if JOB_QUEUE_PATH:
+        queue = JobQueue(JOB_QUEUE_PATH)
+        job_id = queue.enqueue(payload, priority=QUEUE_PRIORITY)
+        with st.spinner(f"順番にPDFを生成しています...（受付番号 {job_id}）"):
+            job = queue.wait(job_id, timeout=QUEUE_WAIT_SECONDS)
+        if job["status"] == "failed":
+            if not demo_mode:
+                store.release(payload["output_pdf_path"])
+            st.error(f"PDF生成に失敗しました: {job['error']}")
+            st.stop()
+        if job["status"] != "done":
+            st.info(f"混み合っています。受付番号 {job_id} で生成を続けています（保存先: {job['result_path'] or '未定'}）。")
+            st.stop()
+        out_pdf_path = job["result_path"]
+    else:
+        with st.spinner("PDFを生成しています..."):
+            try:
+                out_pdf_path, timings = default_gate().run(build_pdf_from_payload, payload)
+            except GateBusy as e:
+                if not demo_mode:
+                    store.release(payload["output_pdf_path"])
+                st.warning(f"ただいま混み合っています。{e.retry_after}秒ほどしてからもう一度「鑑定書PDF生成」を押してください。")
+                st.stop()
+            except Exception as e:
+                if not demo_mode:
+                    store.release(payload["output_pdf_path"])
+                st.error(f"PDF生成に失敗しました: {e}")
+                st.stop()
+        st.caption(f"順番待ち {timings['queue_wait']:.1f}秒 / 生成 {timings['build']:.1f}秒")
+
     st.success(f"PDFを生成しました: {out_pdf_path}")
 
     with open(out_pdf_path, "rb") as f:
@@ -0,0 +1,248 @@
+import os
+import io
+import sys
+import json
+import math
+import zlib
+import hashlib
+import argparse
+
+from PIL import Image
+from reportlab.pdfbase import pdfdoc
+from reportlab.lib.boxstuff import aspectRatioFix
+from reportlab.lib.utils import _digester
+
+from kami_bundle import asset_exists, asset_mtime, read_asset
+
+#---------------------------------------------------------
+# 神様画像（photo.png）の配置別バリアントを事前に作っておく
+#
+#   assets/kami/<no>/variants/
+#       manifest.json
+#       photo_<配置>.jpg     … 色データ（PDFにはDCTのまま埋め込む＝描画時にデコードしない）
+#       photo_<配置>.rgb.z   … 色データ（べた塗りの多い絵でJPEGより小さければこちら。zlib圧縮のRGB）
+#       photo_<配置>.smask   … 透過（8bitグレーをzlib圧縮した生データ＝そのままSMaskになる）
+#---------------------------------------------------------
+
+# 配置名: 描画枠（pt）。build_pdf の各ページの描画サイズと合わせる
+PLACEMENTS = {
+    "p11": (152, 199.5),     # 11ページ：4柱の神様（160x210 の 0.95倍）
+    "p29": (110, 150),       # 29ページ：神社情報のカード
+    "omake04": (130, 180),   # おまけ：年/月のご守護
+}
+
+DEFAULT_DPI = 200
+DEFAULT_JPEG_QUALITY = 88
+VARIANTS_DIRNAME = "variants"
+MANIFEST_NAME = "manifest.json"
+
+
+def build_kami_variants(kami_folder: str, dpi: int = DEFAULT_DPI, quality: int = DEFAULT_JPEG_QUALITY) -> dict:
+    """kami_folder/photo.png から配置別バリアントを作り、manifest を返す"""
+    photo_path = os.path.join(kami_folder, "photo.png")
+    if not os.path.exists(photo_path):
+        raise FileNotFoundError(f"ファイルが見つかりません: {photo_path}")
+
+    out_dir = os.path.join(kami_folder, VARIANTS_DIRNAME)
+    os.makedirs(out_dir, exist_ok=True)
+
+    with Image.open(photo_path) as src:
+        rgba = src.convert("RGBA")
+
+    with open(photo_path, "rb") as f:
+        source = f.read()
+    manifest = {
+        # 元の photo.png の中身（コピーで更新時刻が変わっても使えるよう、時刻ではなく中身で照合する）
+        "source_size": len(source),
+        "source_sha256": hashlib.sha256(source).hexdigest(),
+        "dpi": dpi,
+        "placements": {},
+    }
+    for name, (box_w, box_h) in PLACEMENTS.items():
+        img = rgba.copy()
+        # 枠に収まるサイズまで縮小（拡大はしない）
+        img.thumbnail((math.ceil(box_w * dpi / 72), math.ceil(box_h * dpi / 72)), Image.LANCZOS)
+
+        # 色データは JPEG と zlib(RGB) の小さい方を採用する
+        rgb = img.convert("RGB")
+        buf = io.BytesIO()
+        rgb.save(buf, "JPEG", quality=quality, optimize=True)
+        jpeg_data = buf.getvalue()
+        flate_data = zlib.compress(rgb.tobytes(), 9)
+        if len(jpeg_data) <= len(flate_data):
+            color_name, color_filter, color_data = f"photo_{name}.jpg", "DCTDecode", jpeg_data
+        else:
+            color_name, color_filter, color_data = f"photo_{name}.rgb.z", "FlateDecode", flate_data
+        for stale in (f"photo_{name}.jpg", f"photo_{name}.rgb.z"):
+            if stale != color_name and os.path.exists(os.path.join(out_dir, stale)):
+                os.remove(os.path.join(out_dir, stale))
+        with open(os.path.join(out_dir, color_name), "wb") as f:
+            f.write(color_data)
+
+        smask_name = None
+        alpha = img.getchannel("A")
+        if alpha.getextrema() != (255, 255):
+            smask_name = f"photo_{name}.smask"
+            with open(os.path.join(out_dir, smask_name), "wb") as f:
+                f.write(zlib.compress(alpha.tobytes(), 9))
+
+        manifest["placements"][name] = {
+            "width": img.width,
+            "height": img.height,
+            "color": color_name,
+            "color_filter": color_filter,
+            "smask": smask_name,
+        }
+
+    with open(os.path.join(out_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def build_all_variants(kami_root: str, dpi: int = DEFAULT_DPI, quality: int = DEFAULT_JPEG_QUALITY) -> list[str]:
+    """assets/kami/ 以下の全ての神様フォルダについてバリアントを作る"""
+    done = []
+    for entry in sorted(os.listdir(kami_root), key=lambda s: (not s.isdigit(), s.zfill(4))):
+        folder = os.path.join(kami_root, entry)
+        if os.path.isdir(folder) and os.path.exists(os.path.join(folder, "photo.png")):
+            build_kami_variants(folder, dpi, quality)
+            done.append(folder)
+    return done
+
+
+#---------------------------------------------------------
+# 描画側
+#---------------------------------------------------------
+_manifest_cache: dict[str, tuple[float, dict]] = {}
+_photo_hash_cache: dict[str, tuple[float, str]] = {}
+_stale_warned: set[str] = set()
+
+
+def _photo_sha256(photo_path: str) -> str:
+    """photo.png の sha256（更新時刻が変わらなければ読み直さない）"""
+    mtime = asset_mtime(photo_path)
+    cached = _photo_hash_cache.get(photo_path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    digest = hashlib.sha256(read_asset(photo_path)).hexdigest()
+    _photo_hash_cache[photo_path] = (mtime, digest)
+    return digest
+
+
+def _source_matches(photo_path: str, manifest: dict) -> bool:
+    if not asset_exists(photo_path):
+        return True
+    if "source_sha256" not in manifest:
+        # 旧形式の manifest（更新時刻で照合していた）
+        return asset_mtime(photo_path) == manifest.get("source_mtime")
+    return _photo_sha256(photo_path) == manifest["source_sha256"]
+
+
+def load_variant(kami_folder: str, placement: str) -> dict | None:
+    """使えるバリアントがあれば {width, height, color_path, smask_path, key} を返す。
+    無い・photo.png の中身が作ったときと違う（作り直し前）場合は None"""
+    out_dir = os.path.join(kami_folder, VARIANTS_DIRNAME)
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    try:
+        mtime = asset_mtime(manifest_path)
+    except OSError:
+        return None
+
+    cached = _manifest_cache.get(manifest_path)
+    if cached and cached[0] == mtime:
+        manifest = cached[1]
+    else:
+        try:
+            manifest = json.loads(read_asset(manifest_path).decode("utf-8"))
+        except Exception as e:
+            print(f"⚠ variants manifest read error: path={manifest_path} err={e}")
+            return None
+        _manifest_cache[manifest_path] = (mtime, manifest)
+
+    photo_path = os.path.join(kami_folder, "photo.png")
+    if not _source_matches(photo_path, manifest):
+        if manifest_path not in _stale_warned:
+            _stale_warned.add(manifest_path)
+            print(f"⚠ variants are stale (photo.png changed), run asset_variants.py: path={manifest_path}")
+        return None
+
+    v = (manifest.get("placements") or {}).get(placement)
+    if not v:
+        return None
+    return {
+        "width": int(v["width"]),
+        "height": int(v["height"]),
+        "color_path": os.path.join(out_dir, v["color"]),
+        "color_filter": v.get("color_filter", "DCTDecode"),
+        "smask_path": os.path.join(out_dir, v["smask"]) if v.get("smask") else None,
+        "key": _digester(f"{out_dir}|{placement}|{mtime}".encode("utf-8")),
+    }
+
+
+def _raw_image_xobject(name: str, path: str, filter_name: str, width: int, height: int,
+                       color_space: str) -> pdfdoc.PDFImageXObject:
+    img = pdfdoc.PDFImageXObject(name)
+    img.streamContent = read_asset(path)
+    img.name = name
+    img.width = width
+    img.height = height
+    img.bitsPerComponent = 8
+    img.colorSpace = color_space
+    img._filters = (filter_name,)
+    img.mask = None
+    return img
+
+
+def draw_variant(c, variant: dict, x: float, y: float, width: float, height: float,
+                 preserveAspectRatio: bool = False, anchor: str = "c") -> None:
+    """canvas.drawImage と同じ描き方で、事前圧縮した色データ + SMask の画像XObjectを置く。
+    reportlab は JPEG に透過を付けられない（毎回PNGをデコードする）ので、XObject の登録だけ自前で行う"""
+    doc = c._doc
+    name = variant["key"]
+    regName = doc.getXObjectName(name)
+    imgObj = doc.idToObject.get(regName, None)
+    if not imgObj:
+        # 既に圧縮済みのデータをそのままストリームにする（rl_config.useA85 の ASCII85 化もしない）
+        imgObj = _raw_image_xobject(name, variant["color_path"], variant["color_filter"],
+                                    variant["width"], variant["height"], "DeviceRGB")
+        c._setXObjects(imgObj)
+        doc.Reference(imgObj, regName)
+        doc.addForm(name, imgObj)
+
+        if variant["smask_path"]:
+            smask = _raw_image_xobject(_digester((name + "smask").encode("ascii")), variant["smask_path"],
+                                       "FlateDecode", variant["width"], variant["height"], "DeviceGray")
+            mRegName = doc.getXObjectName(smask.name)
+            c._setXObjects(smask)
+            imgObj.smask = doc.Reference(smask, mRegName)
+
+    c._currentPageHasImages = 1
+    x, y, width, height, _scaled = aspectRatioFix(preserveAspectRatio, anchor, x, y, width, height,
+                                                  imgObj.width, imgObj.height)
+    c.saveState()
+    c.translate(x, y)
+    c.scale(width, height)
+    c._code.append("/%s Do" % regName)
+    c.restoreState()
+    c._formsinuse.append(name)
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="神様画像の配置別バリアント（圧縮済みの色データ＋SMask）を事前生成します")
+    ap.add_argument("--kami-dir", default=None, help="assets/kami のパス（省略時は build_pdf の KAMI_DIR）")
+    ap.add_argument("--dpi", type=int, default=DEFAULT_DPI, help=f"配置サイズに対する解像度（既定 {DEFAULT_DPI}）")
+    ap.add_argument("--quality", type=int, default=DEFAULT_JPEG_QUALITY, help="JPEG品質")
+    args = ap.parse_args(argv)
+
+    kami_dir = args.kami_dir
+    if kami_dir is None:
+        from build_pdf import KAMI_DIR
+        kami_dir = KAMI_DIR
+
+    done = build_all_variants(kami_dir, args.dpi, args.quality)
+    print(f"✅ バリアントを作成しました: {len(done)} 柱 ({args.dpi}dpi)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,455 @@
+import os
+import io
+import re
+import sys
+import json
+import time
+import heapq
+import queue
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import importlib
+import threading
+import statistics
+import multiprocessing as mp
+
+from memprofile import MemoryProfile, rss_mb, peak_rss_mb
+
+#---------------------------------------------------------
+# ベンチマーク・負荷試験
+#
+#   python bench.py load --workers 1,2,4 --threads 1,2 --operators 8 --jobs 60
+#   python bench.py linearize --jobs 10 --bandwidth 1.5,5,20
+#   python bench.py memory --jobs 5 --max-peak-mb 120 --flame flame.txt
+#
+# 合成アセット（synth_assets.py）を一時フォルダに作って使うので、
+# 本番の assets/ が無くてもオフラインで回せる。
+#---------------------------------------------------------
+
+DEFAULT_TARGET = "build_pdf:build_pdf_from_payload"
+
+READERS = ["Reader A", "Reader B", "Reader C"]
+CLIENTS = ["Yamada", "Suzuki", "Tanaka", "Sato", "Takahashi", "Ito", "Watanabe", "Nakamura"]
+
+
+def make_payload_mix(n: int, seed: int = 0, preview_ratio: float = 0.0) -> list[dict]:
+    """実運用に近い入力の組み合わせ（神様の重複あり・おまけ有り多め・講座ページ少なめ）"""
+    rnd = random.Random(seed)
+    out = []
+    for i in range(n):
+        gods = [rnd.randint(1, 12) for _ in range(4)]
+        if rnd.random() < 0.3:
+            gods[2] = gods[0]  # 同じ神様が複数の役割に入るケース
+        out.append({
+            "reader_name": rnd.choice(READERS),
+            "client_name": f"{rnd.choice(CLIENTS)}{i}",
+            "birthday": f"{rnd.randint(1940, 2010)}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}",
+            "tenmei": gods[0],
+            "syukumei": gods[1],
+            "shimei": gods[2],
+            "unmei": gods[3],
+            "include_bonus": rnd.random() < 0.8,
+            "include_course": rnd.random() < 0.2,
+            "preview": rnd.random() < preview_ratio,
+        })
+    return out
+
+
+def load_target(spec: str):
+    """"module:function" を import して返す"""
+    mod_name, _, func_name = spec.partition(":")
+    return getattr(importlib.import_module(mod_name), func_name or "build_pdf_from_payload")
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    k = (len(s) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(s) - 1)
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+
+#---------------------------------------------------------
+# ワーカープロセス：threads 本のスレッドでジョブキューを消化する
+#---------------------------------------------------------
+def _worker_main(target_spec: str, threads: int, warmup: dict | None, jobs_q, results_q) -> None:
+    fn = load_target(target_spec)
+    if warmup is not None:
+        fn(dict(warmup))  # フォント登録などの初回コストは計測から外す
+
+    cpu0 = os.times()
+    results_q.put(("ready", os.getpid()))
+
+    def loop():
+        while True:
+            item = jobs_q.get()
+            if item is None:
+                return
+            job_id, payload = item
+            t0 = time.perf_counter()
+            err = None
+            try:
+                fn(payload)
+            except Exception as e:
+                err = f"{type(e).__name__}: {e}"
+            results_q.put(("job", job_id, time.perf_counter() - t0, err))
+
+    ts = [threading.Thread(target=loop, daemon=True) for _ in range(threads)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+
+    cpu1 = os.times()
+    results_q.put(("worker", os.getpid(),
+                   (cpu1.user - cpu0.user) + (cpu1.system - cpu0.system),
+                   {"rss_mb": rss_mb(), "peak_rss_mb": peak_rss_mb()}))
+
+
+def run_load(target_spec: str, workers: int, threads: int, operators: int, payloads: list[dict],
+             think_time: float = 0.0, warmup: bool = True, start_method: str | None = None) -> dict:
+    """operators 人が「投入→完了を待つ→(考える)→次を投入」を繰り返す閉ループで負荷をかける"""
+    ctx = mp.get_context(start_method) if start_method else mp.get_context()
+    jobs_q = ctx.Queue()
+    results_q = ctx.Queue()
+    procs = [ctx.Process(target=_worker_main,
+                         args=(target_spec, threads, payloads[0] if warmup else None, jobs_q, results_q))
+             for _ in range(workers)]
+    for p in procs:
+        p.start()
+
+    pending = list(enumerate(payloads))
+    submitted_at: dict[int, float] = {}
+    latencies: list[float] = []
+    services: list[float] = []
+    errors: list[str] = []
+    worker_stats: list[dict] = []
+
+    def submit():
+        job_id, payload = pending.pop(0)
+        submitted_at[job_id] = time.perf_counter()
+        jobs_q.put((job_id, payload))
+
+    # 全ワーカーの起動・ウォームアップが終わってから計測を始める
+    ready = 0
+    while ready < workers:
+        kind, *_rest = results_q.get(timeout=300)
+        if kind == "ready":
+            ready += 1
+
+    t_start = time.perf_counter()
+    for _ in range(min(operators, len(pending))):
+        submit()
+
+    # 考え中のオペレーターが次を投入する予定時刻
+    due: list[float] = []
+    done = 0
+    while done < len(payloads):
+        now = time.perf_counter()
+        while due and due[0] <= now and pending:
+            heapq.heappop(due)
+            submit()
+        timeout = max(0.001, due[0] - now) if due else 600
+        try:
+            kind, *rest = results_q.get(timeout=timeout)
+        except queue.Empty:
+            if due:
+                continue
+            raise
+        if kind != "job":
+            worker_stats.append({"pid": rest[0], "cpu_s": rest[1], **rest[2]})
+            continue
+        job_id, service, err = rest
+        latencies.append(time.perf_counter() - submitted_at.pop(job_id))
+        services.append(service)
+        if err:
+            errors.append(err)
+        done += 1
+        if pending:
+            if think_time:
+                heapq.heappush(due, time.perf_counter() + think_time)
+            else:
+                submit()
+    wall = time.perf_counter() - t_start
+
+    for _ in range(workers * threads):
+        jobs_q.put(None)
+    while len(worker_stats) < workers:
+        kind, *rest = results_q.get(timeout=60)
+        if kind == "worker":
+            worker_stats.append({"pid": rest[0], "cpu_s": rest[1], **rest[2]})
+    for p in procs:
+        p.join()
+
+    cpu_total = sum(w["cpu_s"] for w in worker_stats)
+    peaks = [w["peak_rss_mb"] for w in worker_stats if w.get("peak_rss_mb") is not None]
+    return {
+        "workers": workers,
+        "threads": threads,
+        "operators": operators,
+        "jobs": len(payloads),
+        "errors": len(errors),
+        "error_samples": errors[:3],
+        "wall_s": wall,
+        "throughput_jobs_per_s": len(payloads) / wall if wall else 0.0,
+        "latency_p50_s": percentile(latencies, 50),
+        "latency_p95_s": percentile(latencies, 95),
+        "latency_p99_s": percentile(latencies, 99),
+        "service_p50_s": percentile(services, 50),
+        "service_p95_s": percentile(services, 95),
+        "service_mean_s": statistics.fmean(services) if services else 0.0,
+        # ワーカーCPU時間（ウォームアップ後） / (経過時間 × コア数)
+        "cpu_util_pct": 100.0 * cpu_total / (wall * (os.cpu_count() or 1)) if wall else 0.0,
+        "rss_per_worker_mb_max": max(peaks) if peaks else None,
+        "rss_per_worker_mb_mean": statistics.fmean(peaks) if peaks else None,
+        "worker_stats": worker_stats,
+    }
+
+
+def print_table(rows: list[dict]) -> None:
+    base = rows[0]["throughput_jobs_per_s"] if rows else 0
+    head = f"{'workers':>7} {'threads':>7} {'jobs/s':>8} {'speedup':>7} {'p50[s]':>7} {'p95[s]':>7} {'p99[s]':>7} {'CPU%':>6} {'RSS/w[MB]':>9} {'err':>4}"
+    print(head)
+    print("-" * len(head))
+    for r in rows:
+        rss = r["rss_per_worker_mb_max"]
+        print(f"{r['workers']:>7} {r['threads']:>7} {r['throughput_jobs_per_s']:>8.2f} "
+              f"{(r['throughput_jobs_per_s'] / base if base else 0):>7.2f} "
+              f"{r['latency_p50_s']:>7.3f} {r['latency_p95_s']:>7.3f} {r['latency_p99_s']:>7.3f} "
+              f"{r['cpu_util_pct']:>6.1f} {(f'{rss:.0f}' if rss is not None else '-'):>9} {r['errors']:>4}")
+
+
+def find_saturation(rows: list[dict], min_gain: float = 0.10) -> dict | None:
+    """スレッド数ごとに workers を増やしても伸びが min_gain 未満になった最初の点"""
+    by_threads: dict[int, list[dict]] = {}
+    for r in rows:
+        by_threads.setdefault(r["threads"], []).append(r)
+    for threads, rs in sorted(by_threads.items()):
+        rs.sort(key=lambda r: r["workers"])
+        for prev, cur in zip(rs, rs[1:]):
+            gain = cur["throughput_jobs_per_s"] / prev["throughput_jobs_per_s"] - 1 if prev["throughput_jobs_per_s"] else 0
+            if gain < min_gain:
+                return {"threads": threads, "workers": prev["workers"], "next_workers": cur["workers"], "gain": gain}
+    return None
+
+
+def _int_list(s: str) -> list[int]:
+    return [int(x) for x in s.split(",") if x.strip()]
+
+
+def prepare_env(assets: str | None, font: str | None) -> tuple[str, str]:
+    """合成アセットと出力先を用意して、ワーカーが import する前に環境変数で差し替える"""
+    work = tempfile.mkdtemp(prefix="kami_bench_")
+    if assets is None:
+        from synth_assets import build_synthetic_assets
+        assets = build_synthetic_assets(os.path.join(work, "assets"), font)
+    os.environ["KAMI_ASSETS_DIR"] = os.path.abspath(assets)
+    os.environ["KAMI_OUTPUTS_DIR"] = os.path.join(work, "outputs")
+    return work, assets
+
+
+def cmd_load(args) -> int:
+    work, assets = prepare_env(args.assets, args.font)
+    try:
+        payloads = make_payload_mix(args.jobs, args.seed, args.preview_ratio)
+        rows = []
+        for workers in _int_list(args.workers):
+            for threads in _int_list(args.threads):
+                operators = args.operators or workers * threads * 2
+                print(f"… workers={workers} threads={threads} operators={operators}", file=sys.stderr)
+                rows.append(run_load(args.target, workers, threads, operators, payloads,
+                                     args.think_time, not args.no_warmup, args.start_method))
+        print_table(rows)
+        sat = find_saturation(rows)
+        if sat:
+            print(f"\n頭打ち: threads={sat['threads']} で workers {sat['workers']}→{sat['next_workers']} の伸びが {sat['gain'] * 100:.0f}%")
+        report = {
+            "target": args.target,
+            "assets": assets,
+            "cpu_count": os.cpu_count(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": rows,
+            "saturation": sat,
+        }
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print("✅ JSONを書き出しました:", args.json)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work, ignore_errors=True)
+    return 0
+
+
+def _first_page_end(pdf_bytes: bytes) -> int | None:
+    """線形化辞書の /E（ここまで届けば1ページ目を表示できる）"""
+    m = re.search(rb"/Linearized\s+1.*?/E\s+(\d+)", pdf_bytes[:1024], re.S)
+    return int(m.group(1)) if m else None
+
+
+def cmd_linearize(args) -> int:
+    """線形化の書き出しコストと、1ページ目表示までの時間（推定）を比べる"""
+    work, assets = prepare_env(args.assets, args.font)
+    try:
+        import build_pdf
+        from linearize import write_linearized
+
+        bandwidths = [float(x) for x in args.bandwidth.split(",") if x.strip()]
+        rows = []
+        for payload in make_payload_mix(args.jobs, args.seed):
+            writer = build_pdf.build_writer_from_payload(payload)
+            row = {"pages": len(writer.pages)}
+            for mode, write in (("plain", writer.write), ("linearized", lambda f: write_linearized(writer, f))):
+                times = []
+                for _ in range(args.repeat):
+                    buf = io.BytesIO()
+                    t0 = time.perf_counter()
+                    write(buf)
+                    times.append(time.perf_counter() - t0)
+                data = buf.getvalue()
+                # 線形化していないPDFは末尾の xref が無いと表示できないので全体が必要
+                first = _first_page_end(data) if mode == "linearized" else len(data)
+                row[mode] = {"write_s": min(times), "size": len(data), "first_page_bytes": first}
+            rows.append(row)
+
+        def mean(key, mode):
+            return statistics.fmean(r[mode][key] for r in rows)
+
+        summary = {"jobs": len(rows), "rtt_s": args.rtt, "modes": {}}
+        for mode in ("plain", "linearized"):
+            summary["modes"][mode] = {
+                "write_ms": mean("write_s", mode) * 1000,
+                "size_kb": mean("size", mode) / 1024,
+                "first_page_kb": mean("first_page_bytes", mode) / 1024,
+                "ttfp_s": {str(bw): args.rtt + mean("first_page_bytes", mode) * 8 / (bw * 1e6) for bw in bandwidths},
+            }
+
+        pm, lm = summary["modes"]["plain"], summary["modes"]["linearized"]
+        print(f"{'mode':<11} {'write[ms]':>9} {'size[KB]':>9} {'1st page[KB]':>12} " +
+              " ".join(f"{'TTFP@' + str(bw) + 'Mbps':>14}" for bw in bandwidths))
+        for mode, s in (("plain", pm), ("linearized", lm)):
+            print(f"{mode:<11} {s['write_ms']:>9.1f} {s['size_kb']:>9.0f} {s['first_page_kb']:>12.0f} " +
+                  " ".join(f"{s['ttfp_s'][str(bw)]:>13.2f}s" for bw in bandwidths))
+        print(f"\n書き出しの追加コスト: {lm['write_ms'] - pm['write_ms']:+.1f} ms / 件")
+        for bw in bandwidths:
+            print(f"1ページ目表示の短縮 @{bw}Mbps: {pm['ttfp_s'][str(bw)] - lm['ttfp_s'][str(bw)]:.2f} s")
+
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"summary": summary, "results": rows}, f, ensure_ascii=False, indent=2)
+            print("✅ JSONを書き出しました:", args.json)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work, ignore_errors=True)
+    return 0
+
+
+def cmd_memory(args) -> int:
+    """段階ごとのメモリ（tracemalloc・RSS）を測り、ピークが上限を超えたら失敗で終わる"""
+    work, assets = prepare_env(args.assets, args.font)
+    peak = 0.0
+    try:
+        import build_pdf
+
+        rows = []
+        profiles = []
+        for i, payload in enumerate(make_payload_mix(args.jobs, args.seed, args.preview_ratio)):
+            payload["linearize"] = args.linearize
+            with MemoryProfile(stacks=bool(args.flame), frames=args.frames) as prof:
+                build_pdf.build_pdf_bytes(payload)
+            profiles.append(prof)
+            # 1件目はフォント登録などの初回コストを含む
+            rows.append({"job": i, "cold": i == 0, "preview": bool(payload.get("preview")),
+                         "peak_mb": prof.peak_mb, "rss_mb": rss_mb(), "stages": prof.to_dict()["stages"]})
+
+        print(f"{'job':>3} {'':<5} {'peak[MB]':>9} {'RSS[MB]':>8}")
+        for r in rows:
+            rss = f"{r['rss_mb']:.0f}" if r["rss_mb"] is not None else "-"
+            tag = "cold" if r["cold"] else ("prev" if r["preview"] else "")
+            print(f"{r['job']:>3} {tag:<5} {r['peak_mb']:>9.2f} {rss:>8}")
+
+        worst = max(range(len(profiles)), key=lambda i: profiles[i].peak_mb)
+        print(f"\n--- 1件目（初回） ---\n{profiles[0].report()}")
+        if worst != 0:
+            print(f"\n--- ピーク最大（job {worst}） ---\n{profiles[worst].report()}")
+        peak = profiles[worst].peak_mb
+        print(f"\nピーク（tracemalloc）最大: {peak:.2f} MB / プロセスの最大RSS: {peak_rss_mb() or 0:.0f} MB")
+
+        if args.flame:
+            with open(args.flame, "w", encoding="utf-8") as f:
+                f.write(profiles[worst].flame())
+            print("✅ flame（collapsed stack）を書き出しました:", args.flame)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"results": rows, "worst": profiles[worst].to_dict(),
+                           "peak_rss_mb": peak_rss_mb()}, f, ensure_ascii=False, indent=2)
+            print("✅ JSONを書き出しました:", args.json)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work, ignore_errors=True)
+
+    if args.max_peak_mb is not None and peak > args.max_peak_mb:
+        print(f"⚠ ピークが上限を超えました: {peak:.2f} MB > {args.max_peak_mb} MB")
+        return 1
+    return 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="鑑定書PDF生成のベンチマーク")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("load", help="同時利用の負荷試験（ワーカー数×スレッド数をスイープ）")
+    p.add_argument("--target", default=DEFAULT_TARGET, help=f"呼び出す関数 module:function（既定 {DEFAULT_TARGET}）")
+    p.add_argument("--workers", default="1,2,4", help="ワーカープロセス数（カンマ区切り）")
+    p.add_argument("--threads", default="1,2", help="ワーカーごとのスレッド数（カンマ区切り）")
+    p.add_argument("--operators", type=int, default=0, help="同時に操作するオペレーター数（0=workers×threads×2）")
+    p.add_argument("--jobs", type=int, default=40, help="1設定あたりのジョブ数")
+    p.add_argument("--think-time", type=float, default=0.0, help="オペレーターが次を投入するまでの待ち（秒）")
+    p.add_argument("--preview-ratio", type=float, default=0.0, help="プレビュー生成の割合（0〜1）")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--assets", default=None, help="使うアセット（省略時は合成アセットを生成）")
+    p.add_argument("--font", default=None, help="合成アセットに入れる TTF（本番相当のフォント負荷を見たいとき）")
+    p.add_argument("--start-method", default=None, choices=["fork", "spawn", "forkserver"])
+    p.add_argument("--no-warmup", action="store_true", help="初回（フォント登録など）も計測に含める")
+    p.add_argument("--json", default=None, help="結果をJSONで保存するパス")
+    p.add_argument("--keep", action="store_true", help="一時フォルダ（合成アセット・出力）を残す")
+    p.set_defaults(func=cmd_load)
+
+    p = sub.add_parser("linearize", help="線形化（Web表示用）の書き出しコストと1ページ目表示時間の比較")
+    p.add_argument("--jobs", type=int, default=10, help="比べる鑑定書の件数")
+    p.add_argument("--repeat", type=int, default=3, help="書き出しの繰り返し回数（最小値を採用）")
+    p.add_argument("--bandwidth", default="1.5,5,20", help="想定回線速度 Mbps（カンマ区切り）")
+    p.add_argument("--rtt", type=float, default=0.1, help="想定往復遅延（秒）")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--assets", default=None, help="使うアセット（省略時は合成アセットを生成）")
+    p.add_argument("--font", default=None)
+    p.add_argument("--json", default=None)
+    p.add_argument("--keep", action="store_true")
+    p.set_defaults(func=cmd_linearize)
+
+    p = sub.add_parser("memory", help="段階ごとのメモリ（tracemalloc・RSS）とアセット別の内訳")
+    p.add_argument("--jobs", type=int, default=5, help="測る鑑定書の件数（1件目は初回コスト込み）")
+    p.add_argument("--preview-ratio", type=float, default=0.0)
+    p.add_argument("--linearize", action="store_true", help="線形化して書き出す")
+    p.add_argument("--frames", type=int, default=25, help="--flame のとき tracemalloc が記録する呼び出しの深さ")
+    p.add_argument("--max-peak-mb", type=float, default=None, help="ピークがこれを超えたら終了コード1（回帰チェック用）")
+    p.add_argument("--flame", default=None, help="ピーク最大の1件の collapsed stack を書き出すパス")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--assets", default=None, help="使うアセット（省略時は合成アセットを生成）")
+    p.add_argument("--font", default=None)
+    p.add_argument("--json", default=None)
+    p.add_argument("--keep", action="store_true")
+    p.set_defaults(func=cmd_memory)
+
+    args = ap.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,8 @@
 import os
+import io
 import sys
 import json
-from datetime import datetime
+from datetime import datetime, date
 from pypdf import PdfWriter, PdfReader
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
@@ -33,24 +34,28 @@ def setup_jp_font(bold: bool = False) -> str:
 
     # Regular
     if "JPFont" not in pdfmetrics.getRegisteredFontNames():
-        if not os.path.exists(regular_path):
+        if not asset_exists(regular_path):
             raise FileNotFoundError(f"フォントが見つかりません: {regular_path}")
-        pdfmetrics.registerFont(TTFont("JPFont", regular_path))
+        with asset_scope("font", regular_path):
+            pdfmetrics.registerFont(TTFont("JPFont", open_asset(regular_path)))
 
     # Bold（入れていれば使う）
     if bold:
-        if os.path.exists(bold_path) and "JPFont-Bold" not in pdfmetrics.getRegisteredFontNames():
-            pdfmetrics.registerFont(TTFont("JPFont-Bold", bold_path))
+        if asset_exists(bold_path) and "JPFont-Bold" not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(TTFont("JPFont-Bold", open_asset(bold_path)))
         if "JPFont-Bold" in pdfmetrics.getRegisteredFontNames():
             return "JPFont-Bold"
 
     return "JPFont"
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-ASSETS_DIR = os.path.join(BASE_DIR, "assets")
+# 環境変数で差し替え可（負荷試験で合成アセットを使う等）
+ASSETS_DIR = os.environ.get("KAMI_ASSETS_DIR") or os.path.join(BASE_DIR, "assets")
 FIXED_DIR = os.path.join(ASSETS_DIR, "fixed")
 KAMI_DIR  = os.path.join(ASSETS_DIR, "kami")
-OUTPUTS_DIR = os.path.join(BASE_DIR, "outputs")
+OUTPUTS_DIR = os.environ.get("KAMI_OUTPUTS_DIR") or os.path.join(BASE_DIR, "outputs")
+PRERENDER_DIR = os.path.join(OUTPUTS_DIR, "_prerender")   # 時期で決まるおまけページの作り置き（prerender.py）
+TMP_PAGES_DIR = os.path.join(OUTPUTS_DIR, "_tmp_pages")   # 個人化ページの中間PDF（1件ごとのフォルダ）
 
 #NAME_RGB = (132, 88, 0)     # 鑑定士・お客様・誕生日の文字の色のRGB
 #NAME_RGB = (140, 95, 5)     # 鑑定士・お客様・誕生日の文字の色のRGB
@@ -60,6 +65,8 @@ OMAKE_RGB = (127, 96, 0)     # 鑑定士・お客様・誕生日の文字の色
 NAME_FONT_SIZE = 44         # 鑑定士・お客様・誕生日の文字サイズ
 COVER_FONT_STYLE = "meiryo"  # "meiryo" フォントはメイリオ
 
+PREVIEW_IMAGE_PX = 200       # プレビュー時の神様画像の長辺ピクセル（低解像度で高速化）
+
 
 
 ROLE_FILE = {
@@ -80,7 +87,7 @@ def ensure_dir(path: str) -> None:
     os.makedirs(path, exist_ok=True)
 
 def must_exist(path: str) -> str:
-    if not os.path.exists(path):
+    if not asset_exists(path):
         raise FileNotFoundError(f"ファイルが見つかりません: {path}")
     return path
 
@@ -101,11 +108,23 @@ def make_placeholder_pdf(path: str, title: str, lines: list[str]) -> str:
 
 import uuid
 
+from output_store import OutputStore, atomic_write, sanitize_filename_component
+from asset_variants import load_variant, draw_variant
+from linearize import write_linearized
+from stream_writer import StreamingPdfWriter
+from stamp import stamp_name, stamp_page
+from memprofile import mark_stage, asset_scope
+from kami_bundle import configure as configure_bundles, asset_exists, asset_mtime, open_asset, read_asset
+
+# KAMI_ASSETS_BUNDLES に .kbundle（またはそれを置いたフォルダ、os.pathsep 区切りで複数可）を指定すると
+# assets/ のファイルは1回だけ開いた mmap から読む（kami_bundle.py で作成）
+configure_bundles(ASSETS_DIR, os.environ.get("KAMI_ASSETS_BUNDLES"))
 
 
 
 
 from reportlab.lib.utils import ImageReader
+from PIL import Image
 
 #==========================
 # meta.json から神様名（漢字＋カナ）を読む
@@ -113,13 +132,12 @@ from reportlab.lib.utils import ImageReader
 def load_kami_title(kami_no: int) -> tuple[str, str]:
     meta_path = os.path.join(KAMI_DIR, str(kami_no), "meta.json")
 
-    if not os.path.exists(meta_path):
+    if not asset_exists(meta_path):
         print(f"⚠ meta.json not found: kami_no={kami_no} path={meta_path}")
         return "", ""
 
     try:
-        with open(meta_path, "r", encoding="utf-8") as f:
-            meta = json.load(f)
+        meta = json.loads(read_asset(meta_path).decode("utf-8"))
     except json.JSONDecodeError as e:
         print(f"⚠ JSONDecodeError in meta.json: kami_no={kami_no}")
         print(f"   path: {meta_path}")
@@ -138,12 +156,11 @@ def load_kami_title(kami_no: int) -> tuple[str, str]:
 def load_kami_shrines(kami_no: int) -> list[tuple[str, str]]:
     """assets/kami/<no>/meta.json の shrines を [(name, pref), ...] で返す"""
     meta_path = os.path.join(KAMI_DIR, str(kami_no), "meta.json")
-    if not os.path.exists(meta_path):
+    if not asset_exists(meta_path):
         return []
 
     try:
-        with open(meta_path, "r", encoding="utf-8") as f:
-            meta = json.load(f)
+        meta = json.loads(read_asset(meta_path).decode("utf-8"))
     except Exception:
         return []
 
@@ -155,6 +172,34 @@ def load_kami_shrines(kami_no: int) -> list[tuple[str, str]]:
             out.append((name, pref))
     return out
 
+_preview_photo_cache: dict[tuple[str, float], Image.Image] = {}
+
+def kami_photo_reader(photo_path: str, preview: bool = False) -> ImageReader:
+    """photo.png の ImageReader。preview 時は長辺 PREVIEW_IMAGE_PX に縮小した画像（キャッシュ）を使う"""
+    if not preview:
+        return ImageReader(open_asset(photo_path))
+
+    key = (photo_path, asset_mtime(photo_path))
+    img = _preview_photo_cache.get(key)
+    if img is None:
+        with Image.open(open_asset(photo_path)) as src:
+            img = src.convert("RGBA")
+        img.thumbnail((PREVIEW_IMAGE_PX, PREVIEW_IMAGE_PX))
+        _preview_photo_cache[key] = img
+    return ImageReader(img)
+
+def draw_kami_photo(c, photo_path: str, placement: str, x: float, y: float, width: float, height: float,
+                    preview: bool = False, **kwargs) -> None:
+    """神様画像を描く。asset_variants.py で作った配置別バリアント（JPEG＋SMask）があればそれを使い、
+    無ければ photo.png をそのまま（プレビュー時は縮小版を）使う"""
+    variant = None if preview else load_variant(os.path.dirname(photo_path), placement)
+    with asset_scope("photo", photo_path):
+        if variant:
+            draw_variant(c, variant, x, y, width, height, **kwargs)
+        else:
+            c.drawImage(kami_photo_reader(photo_path, preview), x, y, width=width, height=height,
+                        mask="auto", **kwargs)
+
 
 
 
@@ -163,14 +208,24 @@ def load_kami_shrines(kami_no: int) -> list[tuple[str, str]]:
 #----------------------------------------------------------
 # ベースPDFと同じサイズでoverlayを作る
 #----------------------------------------------------------
-def make_overlay_for_base(base_pdf_path: str, overlay_path: str, draw_fn) -> str:
-    """baseのページサイズに合わせて overlay を作る（1ページ）"""
+_page_size_cache: dict[tuple[str, float], tuple[float, float]] = {}
+
+def base_page_size(base_pdf_path: str) -> tuple[float, float]:
+    """ベースPDF 1ページ目のサイズ（毎回パースしないようキャッシュ）"""
+    key = (base_pdf_path, asset_mtime(base_pdf_path))
+    size = _page_size_cache.get(key)
+    if size is None:
+        page0 = PdfReader(open_asset(base_pdf_path)).pages[0]
+        size = (float(page0.mediabox.width), float(page0.mediabox.height))
+        _page_size_cache[key] = size
+    return size
+
+def make_overlay_for_base(base_pdf_path: str, overlay_path, draw_fn):
+    """baseのページサイズに合わせて overlay を作る（1ページ）
+    overlay_path はファイルパスでも BytesIO でもよい"""
     font = setup_jp_font()
 
-    base = PdfReader(base_pdf_path)
-    page0 = base.pages[0]
-    w = float(page0.mediabox.width)
-    h = float(page0.mediabox.height)
+    w, h = base_page_size(base_pdf_path)
 
     c = canvas.Canvas(overlay_path, pagesize=(w, h))
     draw_fn(c, w, h, font)
@@ -180,16 +235,22 @@ def make_overlay_for_base(base_pdf_path: str, overlay_path: str, draw_fn) -> str
 
 
 
-def merge_base_and_overlay(base_pdf: str, overlay_pdf: str, out_pdf: str) -> str:
-    """base(1p) + overlay(1p) を重ねて 1p の完成PDFを作る"""
-    base = PdfReader(base_pdf)
+def merge_base_and_overlay(base_pdf: str, overlay_pdf, out_pdf):
+    """base(1p) + overlay(1p) を重ねて 1p の完成PDFを作る
+    overlay_pdf / out_pdf はファイルパスでも BytesIO でもよい
+    merge_page ではなく overlay を Form XObject として押す（stamp.py。base の内容はパースしない）"""
+    with asset_scope("template", base_pdf):
+        base = PdfReader(open_asset(base_pdf))
+        base_page = base.pages[0]
     over = PdfReader(overlay_pdf)
-    page = base.pages[0]
-    page.merge_page(over.pages[0])
     w = PdfWriter()
-    w.add_page(page)
-    with open(out_pdf, "wb") as f:
-        w.write(f)
+    page = w.add_page(base_page)
+    stamp_page(w, page, over.pages[0], stamp_name(base_page, (base_pdf, asset_mtime(base_pdf))))
+    if hasattr(out_pdf, "write"):
+        w.write(out_pdf)
+    else:
+        with open(out_pdf, "wb") as f:
+            w.write(f)
     return out_pdf
 
 #--------グリッド座標を求める関数
@@ -305,8 +366,8 @@ def year_kami_no(year: int) -> int:
 def digitsum(n: int) -> int:
     return sum(int(d) for d in str(n))
 
-def get_effective_year_month():
-    now = datetime.now()
+def get_effective_year_month(now: datetime | None = None):
+    now = now or datetime.now()
     y = now.year
     m = now.month
     d = now.day
@@ -350,9 +411,8 @@ def draw_omake04_kami(c, w, h, title: str, kami_no: int):
     y = h - 130
 
     photo_path = os.path.join(KAMI_DIR, str(kami_no), "photo.png")
-    if os.path.exists(photo_path):
-        img = ImageReader(photo_path)
-        c.drawImage(img, x, y - card_h, width=card_w, height=card_h, mask="auto")
+    if asset_exists(photo_path):
+        draw_kami_photo(c, photo_path, "omake04", x, y - card_h, card_w, card_h)
     else:
         c.rect(x, y - card_h, card_w, card_h)
     
@@ -391,9 +451,88 @@ def main(input_json_path: str):
     return out
 
 
+def reserve_output_path(payload: dict) -> str:
+    """出力先：指定がなければ OutputStore が outputs/YYYY/MM/DD/ に連番付きで排他確保する"""
+    if payload.get("output_pdf_path"):
+        return payload["output_pdf_path"]
+
+    # 名前の "/" などでフォルダ違いのパスにならないよう、ファイル名に使える形にする
+    client_name = sanitize_filename_component(payload["client_name"]) or "noname"
+    created = date.fromisoformat(payload["created"]) if payload.get("created") else date.today()
+    today = created.strftime("%y%m%d")
+    if payload.get("preview"):
+        tag = uuid.uuid4().hex[:8]
+        return os.path.join(OUTPUTS_DIR, "_preview", f"プレビュー_{client_name}_{today}_{tag}.pdf")
+    return OutputStore(OUTPUTS_DIR).reserve(f"鑑定書_{client_name}_{today}.pdf", created)
+
+
 def build_pdf_from_payload(payload: dict) -> str:
     ensure_dir(OUTPUTS_DIR)
 
+    parts = build_parts_from_payload(payload)
+    out_pdf_path = reserve_output_path(payload)
+
+    ensure_dir(os.path.dirname(out_pdf_path) or ".")
+    try:
+        # パートは書き出しながら読むので、壊れたアセットはここで初めてエラーになる
+        atomic_write(out_pdf_path, lambda f: write_parts(parts, f, payload))
+    except Exception:
+        if not payload.get("output_pdf_path"):
+            OutputStore(os.path.dirname(out_pdf_path)).release(out_pdf_path)
+        raise
+
+    return out_pdf_path
+
+
+def build_pdf_bytes(payload: dict) -> bytes:
+    """build_pdf_from_payload と同じPDFをファイルに保存せず bytes で返す（画面プレビュー用）"""
+    parts = build_parts_from_payload(payload)
+    buf = io.BytesIO()
+    write_parts(parts, buf, payload)
+    return buf.getvalue()
+
+
+def write_parts(parts: list, f, payload: dict) -> None:
+    """parts を結合して f に書く
+
+    payload["linearize"] が真なら線形化（Web表示用に最適化）して書く。線形化はページの配置を
+    全体で決めるので、全パートを PdfWriter にまとめてから書く。
+    そうでなければ stream_writer.py でパートごとに書き出し、読み終えたパートから手放す
+    （メモリに残るのはパート1つ分）。
+    """
+    if payload.get("linearize"):
+        writer = assemble_parts(parts)
+        mark_stage("assemble")
+        write_linearized(writer, f)
+    else:
+        w = StreamingPdfWriter(f)
+        for p in parts:
+            with asset_scope("part", p):
+                w.add_part(open_asset(p), part_cache_key(p))
+        w.close()
+    mark_stage("write")
+
+
+def part_cache_key(part) -> tuple | None:
+    """固定のパート（assets・作り置き）なら (パス, 更新時刻)。1件ごとに作ったパートは None"""
+    if not isinstance(part, str) or part.startswith(TMP_PAGES_DIR):
+        return None
+    return (part, asset_mtime(part))
+
+
+def build_writer_from_payload(payload: dict) -> PdfWriter:
+    """payload から全ページを結合した PdfWriter を作る"""
+    writer = assemble_parts(build_parts_from_payload(payload))
+    mark_stage("assemble")
+    return writer
+
+
+def build_parts_from_payload(payload: dict) -> list:
+    """payload から個人化ページを作り、結合する順のパート（PDFパス or BytesIO）を返す
+
+    payload["preview"] が真なら、確認用に個人化ページ（表紙・2・11・29ページ）だけを
+    低解像度の神様画像で作る。中間PDFもディスクに書かずメモリ上で処理する。
+    """
     reader_name = payload["reader_name"]
     client_name = payload["client_name"]
     birthday    = payload["birthday"]  # YYYY-MM-DD
@@ -403,26 +542,32 @@ def build_pdf_from_payload(payload: dict) -> str:
     unmei       = int(payload["unmei"])
     include_bonus  = bool(payload.get("include_bonus", True))
     include_course = bool(payload.get("include_course", False))
+    preview        = bool(payload.get("preview", False))
 
     uniq = unique_gods_in_order(tenmei, syukumei, shimei, unmei)
 
-    # 出力先（Web運用を考えるならUUID付け推奨）
-    out_pdf_path = payload.get("output_pdf_path")
-    if not out_pdf_path:
-        today = datetime.now().strftime("%y%m%d")
-        tag = uuid.uuid4().hex[:8]  # ★同名衝突防止
-        out_pdf_path = os.path.join(OUTPUTS_DIR, f"鑑定書_{client_name}_{today}_{tag}.pdf")
+    # 段階ごとの区切り（memprofile.py でプロファイル中だけ記録される）
+    setup_jp_font()
+    mark_stage("font")
 
     # tmp_dir（Web運用なら毎回ユニークが安全）
-    tmp_dir = os.path.join(OUTPUTS_DIR, "_tmp_pages", uuid.uuid4().hex[:8])
-    ensure_dir(tmp_dir)
+    tmp_dir = None
+    if not preview:
+        tmp_dir = os.path.join(TMP_PAGES_DIR, uuid.uuid4().hex[:8])
+        ensure_dir(tmp_dir)
+
+    def tmp_target(name: str):
+        # プレビューは中間PDFをメモリ上（BytesIO）で受け渡す
+        if preview:
+            return io.BytesIO()
+        return os.path.join(tmp_dir, name)
 
     #----------------------------------------------
     #表紙：cover.pdf に「鑑定士名」を重ねる
     #----------------------------------------------
     cover_base = must_exist(os.path.join(FIXED_DIR, "cover.pdf"))
-    cover_overlay = os.path.join(tmp_dir, "cover_overlay.pdf")
-    cover_done    = os.path.join(tmp_dir, "00_cover_done.pdf")
+    cover_overlay = tmp_target("cover_overlay.pdf")
+    cover_done    = tmp_target("00_cover_done.pdf")
 
     def draw_cover(c, w, h, _unused_font):
         font = setup_jp_font()
@@ -439,13 +584,14 @@ def build_pdf_from_payload(payload: dict) -> str:
 
     make_overlay_for_base(cover_base, cover_overlay, draw_cover)
     merge_base_and_overlay(cover_base, cover_overlay, cover_done)
+    mark_stage("cover")
 
     #----------------------------------------------
     #2ページ目：common02.pdf に「お客様名＋誕生日」を重ねる
     #----------------------------------------------
     p2_base = must_exist(os.path.join(FIXED_DIR, "common02.pdf"))
-    p2_overlay = os.path.join(tmp_dir, "common02_overlay.pdf")
-    p2_done    = os.path.join(tmp_dir, "02_common02_done.pdf")
+    p2_overlay = tmp_target("common02_overlay.pdf")
+    p2_done    = tmp_target("02_common02_done.pdf")
 
     birthday_ja = format_birthday_ja(birthday)
 
@@ -470,13 +616,14 @@ def build_pdf_from_payload(payload: dict) -> str:
 
     make_overlay_for_base(p2_base, p2_overlay, draw_p2)
     merge_base_and_overlay(p2_base, p2_overlay, p2_done)
+    mark_stage("p2")
 
     #----------------------------------------------
     # 11ページ目：common11.pdf に「4柱の神様PNG」を配置
     #----------------------------------------------
     p11_base = must_exist(os.path.join(FIXED_DIR, "common11.pdf"))
-    p11_overlay = os.path.join(tmp_dir, "common11_overlay.pdf")
-    p11_done    = os.path.join(tmp_dir, "11_common11_done.pdf")
+    p11_overlay = tmp_target("common11_overlay.pdf")
+    p11_done    = tmp_target("11_common11_done.pdf")
 
     def draw_p11(c, w, h, _unused_font):
         paths = [
@@ -525,9 +672,8 @@ def build_pdf_from_payload(payload: dict) -> str:
             c.setFont(font, 20)
             c.drawCentredString(cx, kana_y, kana)
 
-            img = ImageReader(p)
-            c.drawImage(img, x, y, width=box_w, height=box_h, mask="auto",
-                        preserveAspectRatio=True, anchor="c")
+            draw_kami_photo(c, p, "p11", x, y, box_w, box_h, preview,
+                            preserveAspectRatio=True, anchor="c")
 
             c.setFont(font, 22)
             c.drawCentredString(cx, label_y, labels[i])
@@ -536,13 +682,14 @@ def build_pdf_from_payload(payload: dict) -> str:
 
     make_overlay_for_base(p11_base, p11_overlay, draw_p11)
     merge_base_and_overlay(p11_base, p11_overlay, p11_done)
+    mark_stage("p11")
 
     #----------------------------------------------
     # 29ページ目：神社情報
     #----------------------------------------------
     p29_base    = must_exist(os.path.join(FIXED_DIR, "common29.pdf"))
-    p29_overlay = os.path.join(tmp_dir, "common29_overlay.pdf")
-    p29_done    = os.path.join(tmp_dir, "29_common29_done.pdf")
+    p29_overlay = tmp_target("common29_overlay.pdf")
+    p29_done    = tmp_target("29_common29_done.pdf")
 
     def draw_p29(c, w, h, _unused_font):
         font = setup_jp_font()
@@ -580,10 +727,9 @@ def build_pdf_from_payload(payload: dict) -> str:
             y = top_y
 
             photo_path = os.path.join(KAMI_DIR, str(kami_no), "photo.png")
-            if os.path.exists(photo_path):
-                img = ImageReader(photo_path)
-                c.drawImage(img, x, y - card_h, width=card_w, height=card_h,
-                            mask="auto", preserveAspectRatio=True, anchor="c")
+            if asset_exists(photo_path):
+                draw_kami_photo(c, photo_path, "p29", x, y - card_h, card_w, card_h, preview,
+                                preserveAspectRatio=True, anchor="c")
             else:
                 c.rect(x, y - card_h, card_w, card_h)
 
@@ -653,6 +799,10 @@ def build_pdf_from_payload(payload: dict) -> str:
 
     make_overlay_for_base(p29_base, p29_overlay, draw_p29)
     merge_base_and_overlay(p29_base, p29_overlay, p29_done)
+    mark_stage("p29")
+
+    if preview:
+        return [cover_done, p2_done, p11_done, p29_done]
 
     # --- 結合台本 ---
     parts: list[str] = []
@@ -683,84 +833,131 @@ def build_pdf_from_payload(payload: dict) -> str:
     if include_bonus:
         parts.append(must_exist(os.path.join(FIXED_DIR, "common_omake01_03.pdf")))
 
-        om04_base = must_exist(os.path.join(FIXED_DIR, "common_omake_04.pdf"))
-
-        kami_year = year_kami_no(y_now)
-        om04_overlay = os.path.join(tmp_dir, "omake04_year_overlay.pdf")
-        om04_done    = os.path.join(tmp_dir, "omake04_year_done.pdf")
-
-        def draw_year(c, w, h, _):
-            draw_omake04_kami(c, w, h, f"{y_now}年のご守護は", kami_year)
-
-        make_overlay_for_base(om04_base, om04_overlay, draw_year)
-        merge_base_and_overlay(om04_base, om04_overlay, om04_done)
-        parts.append(om04_done)
+        # 以下の4ページは時期（と運命の神様から決まる9通り）だけで決まるので、
+        # prerender.py が作り置いたものを使う（無ければここで作って置いておく）
+        parts.append(year_page(y_now))
 
         parts.append(must_exist(os.path.join(FIXED_DIR, "common_omake_05.pdf")))
 
-        y_eff, m_eff = get_effective_year_month()
+        y_eff, m_eff = get_effective_year_month(now)
         kami_month = month_kami_no(y_eff, m_eff)
         kami_personal_month = personal_month_kami_no(kami_month, unmei)
 
-        om04_overlay = os.path.join(tmp_dir, "omake04_month_overlay.pdf")
-        om04_done    = os.path.join(tmp_dir, "omake04_month_done.pdf")
-
-        def draw_month(c, w, h, _):
-            draw_omake04_kami(c, w, h, f"{y_eff}年{m_eff}月のご守護は", kami_month)
-
-        make_overlay_for_base(om04_base, om04_overlay, draw_month)
-        merge_base_and_overlay(om04_base, om04_overlay, om04_done)
-        parts.append(om04_done)
+        parts.append(month_page(y_eff, m_eff))
 
         parts.append(must_exist(os.path.join(FIXED_DIR, "common_omake_06.pdf")))
 
         kami_personal_year = personal_year_kami_no_from_unmei(y_now, unmei)
-
-        om04_overlay = os.path.join(tmp_dir, "omake04_personal_year_overlay.pdf")
-        om04_done    = os.path.join(tmp_dir, "omake04_personal_year_done.pdf")
-
-        def draw_personal_year(c, w, h, _):
-            draw_omake04_kami(c, w, h, f"{y_now}年のあなたのご守護は", kami_personal_year)
-
-        make_overlay_for_base(om04_base, om04_overlay, draw_personal_year)
-        merge_base_and_overlay(om04_base, om04_overlay, om04_done)
-        parts.append(om04_done)
+        parts.append(personal_year_page(y_now, kami_personal_year))
 
         parts.append(must_exist(os.path.join(FIXED_DIR, "common_omake_07.pdf")))
 
-        base1 = must_exist(os.path.join(KAMI_DIR, str(kami_personal_month), "omake_month1.pdf"))
         base23 = must_exist(os.path.join(KAMI_DIR, str(kami_personal_month), "omake_month23.pdf"))
-
-        overlay1 = os.path.join(tmp_dir, "omake_month1_overlay.pdf")
-        done1    = os.path.join(tmp_dir, "omake_month1_done.pdf")
-
-        def draw_month_title(c, w, h, _):
-            font = setup_jp_font()
-            r, g, b = OMAKE_RGB
-            c.setFillColorRGB(r/255, g/255, b/255)
-            c.setFont(font, 60)
-            x = 260
-            y = h - 70
-            c.drawString(x, y, f"{y_eff}年{m_eff}月")
-            c.drawString(x+0.6, y, f"{y_eff}年{m_eff}月")
-            c.drawString(x+1.2, y, f"{y_eff}年{m_eff}月")
-
-        make_overlay_for_base(base1, overlay1, draw_month_title)
-        merge_base_and_overlay(base1, overlay1, done1)
-        parts.append(done1)
+        parts.append(month_title_page(y_eff, m_eff, kami_personal_month))
         parts.append(base23)
 
     if include_course:
         parts.append(must_exist(os.path.join(FIXED_DIR, "common_present01.pdf")))
+    mark_stage("bonus")
 
-    writer = PdfWriter()
-    for p in parts:
-        reader = PdfReader(p)
-        for page in reader.pages:
-            writer.add_page(page)
+    return parts
 
-    ensure_dir(os.path.dirname(out_pdf_path) or ".")
-    with open(out_pdf_path, "wb") as f:
-        writer.write(f)
 
-    return out_pdf_path
+#---------------------------------------------------------
+# 時期で決まるおまけページ（全員共通 / 運命の神様から決まる9通り）
+#
+# PRERENDER_DIR に作り置きがあり、元になるファイル（ベースPDF・画像・meta.json・フォント・
+# このファイル）より新しければそれを使う。無い・古いときはその場で作って置いておく。
+#---------------------------------------------------------
+def omake04_inputs(kami_no: int) -> list[str]:
+    folder = os.path.join(KAMI_DIR, str(kami_no))
+    return [
+        os.path.join(FIXED_DIR, "common_omake_04.pdf"),
+        os.path.join(folder, "photo.png"),
+        os.path.join(folder, "meta.json"),
+        os.path.join(folder, "variants", "manifest.json"),
+    ]
+
+def prerender_is_fresh(path: str, inputs: list[str]) -> bool:
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return False
+    sources = inputs + [os.path.join(ASSETS_DIR, "fonts", "NotoSansJP-Regular.ttf"), os.path.abspath(__file__)]
+    return all(mtime >= asset_mtime(p) for p in sources if asset_exists(p))
+
+def bonus_page(name: str, inputs: list[str], render_fn, force: bool = False):
+    """作り置きのパス、または作ったページ（BytesIO）を返す。render_fn(out) で1ページを書く"""
+    path = os.path.join(PRERENDER_DIR, name)
+    if not force and prerender_is_fresh(path, inputs):
+        return path
+
+    buf = io.BytesIO()
+    render_fn(buf)
+    try:
+        ensure_dir(PRERENDER_DIR)
+        atomic_write(path, lambda f: f.write(buf.getvalue()))
+    except OSError as e:
+        print(f"⚠ prerender write error: path={path} err={e}")
+    buf.seek(0)
+    return buf
+
+def render_omake04_page(title: str, kami_no: int, out) -> None:
+    base = must_exist(os.path.join(FIXED_DIR, "common_omake_04.pdf"))
+    overlay = io.BytesIO()
+
+    def draw(c, w, h, _):
+        draw_omake04_kami(c, w, h, title, kami_no)
+
+    make_overlay_for_base(base, overlay, draw)
+    merge_base_and_overlay(base, overlay, out)
+
+def year_page(year: int, force: bool = False):
+    """「{year}年のご守護は」（全員共通）"""
+    kami_no = year_kami_no(year)
+    return bonus_page(f"year_{year}.pdf", omake04_inputs(kami_no),
+                      lambda out: render_omake04_page(f"{year}年のご守護は", kami_no, out), force)
+
+def month_page(year: int, month: int, force: bool = False):
+    """「{year}年{month}月のご守護は」（全員共通）"""
+    kami_no = month_kami_no(year, month)
+    return bonus_page(f"month_{year}-{month:02d}.pdf", omake04_inputs(kami_no),
+                      lambda out: render_omake04_page(f"{year}年{month}月のご守護は", kami_no, out), force)
+
+def personal_year_page(year: int, kami_no: int, force: bool = False):
+    """「{year}年のあなたのご守護は」（kami_no は 1〜9）"""
+    return bonus_page(f"personal_year_{year}_{kami_no}.pdf", omake04_inputs(kami_no),
+                      lambda out: render_omake04_page(f"{year}年のあなたのご守護は", kami_no, out), force)
+
+def month_title_page(year: int, month: int, kami_no: int, force: bool = False):
+    """その月のあなたの神様ページ1枚目（omake_month1.pdf に年月を重ねる。kami_no は 1〜9）"""
+    base1 = must_exist(os.path.join(KAMI_DIR, str(kami_no), "omake_month1.pdf"))
+
+    def draw_month_title(c, w, h, _):
+        font = setup_jp_font()
+        r, g, b = OMAKE_RGB
+        c.setFillColorRGB(r/255, g/255, b/255)
+        c.setFont(font, 60)
+        x = 260
+        y = h - 70
+        c.drawString(x, y, f"{year}年{month}月")
+        c.drawString(x+0.6, y, f"{year}年{month}月")
+        c.drawString(x+1.2, y, f"{year}年{month}月")
+
+    def render(out):
+        overlay = io.BytesIO()
+        make_overlay_for_base(base1, overlay, draw_month_title)
+        merge_base_and_overlay(base1, overlay, out)
+
+    return bonus_page(f"month_title_{year}-{month:02d}_{kami_no}.pdf", [base1], render, force)
+
+
+def assemble_parts(parts: list) -> PdfWriter:
+    """parts（PDFパス or BytesIO）の全ページを順に1つの PdfWriter にまとめる"""
+    writer = PdfWriter()
+    for p in parts:
+        with asset_scope("part", p):
+            reader = PdfReader(open_asset(p))
+            for page in reader.pages:
+                writer.add_page(page)
+    return writer
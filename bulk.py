@@ -0,0 +1,318 @@
+import os
+import io
+import re
+import sys
+import csv
+import time
+import argparse
+import zipfile
+import multiprocessing
+from datetime import date
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from build_pdf import build_pdf_bytes
+from gate import default_gate, estimate_build_mb, GateBusy
+from output_store import OutputStore, atomic_write, sanitize_filename_component
+
+#---------------------------------------------------------
+# CSV から鑑定書を一括生成して ZIP にまとめる
+#
+#   python bulk.py clients.csv -o 鑑定書.zip [--workers 4]
+#
+# 1行 = 1人。できあがったPDFから順に ZIP に書き込む（全件そろうまで待たない・ディスクに並べない）
+#---------------------------------------------------------
+
+# 列名（英語 / 日本語どちらでも可）→ payload のキー
+COLUMNS = {
+    "reader_name": ["reader_name", "鑑定士名", "鑑定士"],
+    "client_name": ["client_name", "クライアント名", "お客様名", "クライアント"],
+    "birthday": ["birthday", "誕生日"],
+    "tenmei": ["tenmei", "天命"],
+    "syukumei": ["syukumei", "宿命"],
+    "shimei": ["shimei", "使命"],
+    "unmei": ["unmei", "運命"],
+    "include_bonus": ["include_bonus", "おまけ"],
+    "include_course": ["include_course", "講座案内"],
+    "linearize": ["linearize", "Web最適化"],
+}
+REQUIRED = ["reader_name", "client_name", "birthday", "tenmei", "syukumei", "shimei", "unmei"]
+ROLE_KEYS = ["tenmei", "syukumei", "shimei", "unmei"]
+# フォームの初期値と合わせる
+OPTION_DEFAULTS = {"include_bonus": True, "include_course": False, "linearize": False}
+
+TRUE_WORDS = {"1", "true", "yes", "y", "on", "○", "〇", "はい", "有", "あり"}
+FALSE_WORDS = {"0", "false", "no", "n", "off", "×", "いいえ", "無", "なし"}
+
+MIN_BIRTHDAY = date(1925, 1, 1)
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+MAX_POOL_RESTARTS = 3   # ワーカーが落ちた（OOM など）ときにプールを作り直す回数の上限
+
+
+def template_csv() -> bytes:
+    """アップロード用CSVのひな形（Excel で開けるよう BOM付き UTF-8）"""
+    head = ",".join(COLUMNS[k][1] for k in COLUMNS)
+    row = "山田 花子,佐藤 太郎,1990-05-17,3,5,3,11,1,0,1"
+    return ("\ufeff" + head + "\n" + row + "\n").encode("utf-8")
+
+
+def _decode(data: bytes) -> str:
+    for enc in ("utf-8-sig", "cp932"):
+        try:
+            return data.decode(enc)
+        except UnicodeDecodeError:
+            continue
+    raise ValueError("CSVの文字コードを判別できません（UTF-8 か Shift_JIS で保存してください）")
+
+
+def _parse_birthday(text: str) -> date:
+    m = re.fullmatch(r"(\d{4})[-/.年](\d{1,2})[-/.月](\d{1,2})日?", text)
+    if not m:
+        raise ValueError(f"誕生日の形式が不正です: {text}（例: 1990-05-17）")
+    try:
+        d = date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+    except ValueError:
+        raise ValueError(f"存在しない日付です: {text}") from None
+    if not (MIN_BIRTHDAY <= d <= date.today()):
+        raise ValueError(f"誕生日が範囲外です: {text}")
+    return d
+
+
+def _parse_flag(text: str, default: bool) -> bool:
+    t = text.strip().lower()
+    if not t:
+        return default
+    if t in TRUE_WORDS:
+        return True
+    if t in FALSE_WORDS:
+        return False
+    raise ValueError(f"オプションは 1/0（はい/いいえ）で指定してください: {text}")
+
+
+def parse_bulk_csv(data: bytes, valid_kami_nos: set[int] | None = None,
+                   created: date | None = None) -> tuple[list[dict], list[tuple[int, str]]]:
+    """CSV を読み、(payload のリスト, [(行番号, エラー内容), ...]) を返す。
+    payload には ZIP 内のファイル名 "_zip_name" と元の行番号 "_line" も入れる"""
+    valid_kami_nos = valid_kami_nos or set(range(1, 13))
+    created = created or date.today()
+
+    reader = csv.DictReader(io.StringIO(_decode(data)))
+    header = [h.strip() for h in (reader.fieldnames or [])]
+    col_of: dict[str, str] = {}
+    for key, names in COLUMNS.items():
+        for raw, h in zip(reader.fieldnames or [], header):
+            if h in names:
+                col_of[key] = raw
+                break
+    missing = [COLUMNS[k][1] for k in REQUIRED if k not in col_of]
+    if missing:
+        return [], [(1, f"必要な列がありません: {', '.join(missing)}")]
+
+    payloads: list[dict] = []
+    errors: list[tuple[int, str]] = []
+    for line, row in enumerate(reader, start=2):
+        values = {k: str(row.get(col) or "").strip() for k, col in col_of.items()}
+        if not any(values.values()):
+            continue  # 空行
+
+        problems = []
+        if not values["reader_name"]:
+            problems.append("鑑定士名が未入力です。")
+        if not values["client_name"]:
+            problems.append("クライアント名が未入力です。")
+
+        birthday = None
+        try:
+            birthday = _parse_birthday(values["birthday"])
+        except ValueError as e:
+            problems.append(str(e))
+
+        gods = {}
+        for role in ROLE_KEYS:
+            try:
+                gods[role] = int(values[role])
+            except ValueError:
+                problems.append(f"{COLUMNS[role][1]}の神様番号が数字ではありません: {values[role]!r}")
+                continue
+            if gods[role] not in valid_kami_nos:
+                problems.append(f"{COLUMNS[role][1]}の神様番号が範囲外です: {gods[role]}")
+
+        options = {}
+        for key, default in OPTION_DEFAULTS.items():
+            try:
+                options[key] = _parse_flag(values.get(key, ""), default)
+            except ValueError as e:
+                problems.append(f"{COLUMNS[key][1]}: {e}")
+
+        if problems:
+            errors.extend((line, msg) for msg in problems)
+            continue
+
+        payloads.append({
+            "reader_name": values["reader_name"],
+            "client_name": values["client_name"],
+            "birthday": birthday.isoformat(),
+            **gods,
+            **options,
+            "created": created.isoformat(),
+            "_line": line,
+        })
+
+    # ZIP 内のファイル名（同名は (1), (2)… を付ける）
+    used: set[str] = set()
+    for p in payloads:
+        base = zip_entry_name(p["client_name"], created)
+        i = 0
+        while OutputStore.numbered_name(base, i) in used:
+            i += 1
+        p["_zip_name"] = OutputStore.numbered_name(base, i)
+        used.add(p["_zip_name"])
+    return payloads, errors
+
+
+def zip_entry_name(client_name: str, created: date) -> str:
+    """app.py の保存ファイル名と同じ形（鑑定書_<名前>_yymmdd.pdf）"""
+    safe = sanitize_filename_component(client_name) or "noname"
+    return f"鑑定書_{safe}_{created:%y%m%d}.pdf"
+
+
+def _build_one(payload: dict) -> bytes:
+    return build_pdf_bytes({k: v for k, v in payload.items() if not k.startswith("_")})
+
+
+def build_zip(payloads: list[dict], out, max_workers: int = DEFAULT_WORKERS, on_progress=None) -> list[tuple[int, str]]:
+    """payloads を並列に生成し、終わった順に ZIP（out はパスでもファイル風オブジェクトでもよい）へ書き込む。
+    on_progress(済み件数, 全件数, ファイル名) を1件ごとに呼ぶ。失敗した行の [(行番号, エラー内容)] を返す"""
+    failures: list[tuple[int, str]] = []
+    total = len(payloads)
+    # PDF は中身が圧縮済みなので ZIP 側では圧縮しない（CPU を生成に回す）
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_STORED) as zf:
+        for done, (p, result) in enumerate(_gated_results(payloads, max_workers), start=1):
+            if isinstance(result, BrokenProcessPool):
+                result = RuntimeError("生成中のプロセスが異常終了しました（メモリ不足など）")
+            if isinstance(result, BaseException):
+                failures.append((p["_line"], f"{p['_zip_name']}: {result}"))
+                print(f"⚠ bulk build error: line={p['_line']} err={result}")
+            else:
+                zf.writestr(p["_zip_name"], result)
+            if on_progress:
+                on_progress(done, total, p["_zip_name"])
+
+        if failures:
+            zf.writestr("エラー.txt", "\n".join(f"{line}行目: {msg}" for line, msg in failures) + "\n")
+    return failures
+
+
+def _try(fn, arg):
+    try:
+        return fn(arg)
+    except Exception as e:
+        return e
+
+
+def _acquire(gate, mb: float) -> None:
+    """入場制限に入れるまで待つ（一括生成は急がないので、混んでいても諦めずに待ち直す）"""
+    while True:
+        try:
+            gate.acquire(mb)
+            return
+        except GateBusy as e:
+            time.sleep(min(e.retry_after, 5))
+
+
+def _gated_results(payloads: list[dict], max_workers: int):
+    """1件ずつ gate.py の入場制限を通してから生成し、終わった順に (payload, PDF bytes か例外) を返す。
+    同じプロセスの画面からの生成と、同時実行数・メモリ見積もりを共有する"""
+    gate = default_gate()
+    if max_workers <= 1:
+        for p in payloads:
+            mb = estimate_build_mb(p)
+            _acquire(gate, mb)
+            t0 = time.perf_counter()
+            try:
+                result = _try(_build_one, p)
+            finally:
+                gate.release(mb, time.perf_counter() - t0)
+            yield p, result
+        return
+
+    def release_when_done(mb: float, t0: float):
+        # 結果を取り出す前に枠を返す（枠を全部この一括生成が持っていても次を入れられるように）
+        return lambda _f: gate.release(mb, time.perf_counter() - t0)
+
+    def new_pool() -> ProcessPoolExecutor:
+        # fork だと Streamlit のサーバー（他のスレッドがロックを持っている）を複製して子が固まることがある
+        return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    pool = new_pool()
+    restarts = 0
+    pending: dict = {}
+    try:
+        for i, p in enumerate(payloads):
+            while len(pending) >= max_workers:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for f in finished:
+                    yield pending.pop(f), f.exception() or f.result()
+            mb = estimate_build_mb(p)
+            _acquire(gate, mb)
+            while True:
+                try:
+                    f = pool.submit(_build_one, p)
+                    break
+                except BrokenProcessPool as e:
+                    # ワーカーが落ちてプールが使えない。生成中だった行はその例外で失敗として返る。
+                    # 作り直して続ける（何度も落ちるなら残りの行を失敗にして終える）
+                    pool.shutdown(cancel_futures=True)
+                    restarts += 1
+                    print(f"⚠ bulk worker pool broken: restarts={restarts} err={e}")
+                    if restarts > MAX_POOL_RESTARTS:
+                        gate.release(mb)
+                        for f in list(pending):
+                            yield pending.pop(f), f.exception() or f.result()
+                        for rest in payloads[i:]:
+                            yield rest, e
+                        return
+                    pool = new_pool()
+                except BaseException:
+                    gate.release(mb)
+                    raise
+            f.add_done_callback(release_when_done(mb, time.perf_counter()))
+            pending[f] = p
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for f in finished:
+                yield pending.pop(f), f.exception() or f.result()
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="CSV から鑑定書PDFを一括生成して ZIP にまとめます")
+    ap.add_argument("csv", help="クライアント一覧CSV（列は bulk.py の COLUMNS 参照）")
+    ap.add_argument("-o", "--out", required=True, help="出力ZIP")
+    ap.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help=f"並列数（既定 {DEFAULT_WORKERS}）")
+    ap.add_argument("--skip-errors", action="store_true", help="入力エラーの行を飛ばして生成する")
+    args = ap.parse_args(argv)
+
+    with open(args.csv, "rb") as f:
+        payloads, errors = parse_bulk_csv(f.read())
+    for line, msg in errors:
+        print(f"⚠ {line}行目: {msg}")
+    if errors and not args.skip_errors:
+        print("⚠ 入力エラーがあるため中止しました（--skip-errors で該当行を飛ばせます）")
+        return 1
+    if not payloads:
+        print("⚠ 生成する行がありません")
+        return 1
+
+    def progress(done, total, name):
+        print(f"  [{done}/{total}] {name}")
+
+    failures = []
+    atomic_write(args.out, lambda f: failures.extend(build_zip(payloads, f, args.workers, progress)))
+    print(f"✅ {len(payloads) - len(failures)} 件を ZIP にまとめました: {args.out}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+import os
+import math
+import time
+import threading
+from collections import deque
+
+#---------------------------------------------------------
+# PDF生成の入場制限（同時実行数・メモリ見積もり・待ち行列）
+#
+# 小さいコンテナでは数件の同時生成でメモリを使い切って OOM で落ちていたので、
+# 生成の前にここを通し、入れないときは待たせる／「N秒後に再試行」を返す。
+#
+#   KAMI_MAX_BUILDS       同時に生成する数（既定 CPU数）
+#   KAMI_BUILD_MEMORY_MB  生成に使ってよいメモリの合計見積もり（既定 1024）
+#   KAMI_BUILD_QUEUE      待たせておける数（既定 8。超えたら即 GateBusy）
+#   KAMI_BUILD_WAIT       待つ上限秒数（既定 30。超えたら GateBusy）
+#---------------------------------------------------------
+
+# 1件あたりのメモリ見積もり（MB）。bench.py memory の結果に合わせて調整する
+BASE_MB = 30.0      # PdfWriter・reportlab の canvas など
+PAGE_MB = 1.0       # 結合するページ1枚（読み込んだ PdfReader とページツリー）
+IMAGE_MB = 8.0      # 神様画像1枚（photo.png を展開した RGBA）
+PREVIEW_IMAGE_MB = 0.5
+STREAM_PAGES = 3    # 線形化しないときに書き出し中に残るページ（いちばん大きいパート）
+
+
+class GateBusy(Exception):
+    """混雑で受け付けられない。retry_after 秒後に再試行してほしい"""
+
+    def __init__(self, retry_after: float, reason: str):
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.reason = reason
+        super().__init__(f"{reason}（{self.retry_after}秒後に再試行してください）")
+
+
+def estimate_build_mb(payload: dict) -> float:
+    """payload からページ数と画像数を数えて、1件の生成に要るメモリを見積もる"""
+    gods = {int(payload[k]) for k in ("tenmei", "syukumei", "shimei", "unmei")}
+    if payload.get("preview"):
+        # 表紙・2・11・29ページ（11ページに4柱、29ページに重複なしの神様）
+        return BASE_MB + 4 * PAGE_MB + (4 + len(gods)) * PREVIEW_IMAGE_MB
+
+    pages = 9 + 3 * len(gods)           # 表紙〜29ページ（神様ごとに3ページ）
+    images = 4 + len(gods)              # 11ページ・29ページ
+    if payload.get("include_bonus", True):
+        pages += 10
+        images += 3                     # おまけの年/月/あなたの神様（作り置きがあれば実際は0）
+    if payload.get("include_course", False):
+        pages += 1
+    if not payload.get("linearize"):
+        # パートごとに書き出して手放すので、ページ数にはほぼよらない（stream_writer.py）
+        pages = min(pages, STREAM_PAGES)
+    return BASE_MB + pages * PAGE_MB + images * IMAGE_MB
+
+
+class GenerationGate:
+    """スレッド間で共有する入場制限。先着順に、同時数とメモリ見積もりの両方に収まったら通す"""
+
+    def __init__(self, max_concurrent: int, memory_budget_mb: float, max_queue: int, wait_timeout: float):
+        self.max_concurrent = max(1, max_concurrent)
+        self.memory_budget_mb = memory_budget_mb
+        self.max_queue = max_queue
+        self.wait_timeout = wait_timeout
+        self._cond = threading.Condition()
+        self._active = 0
+        self._reserved_mb = 0.0
+        self._waiting: deque = deque()
+        self._avg_build = 5.0           # 直近の生成時間（秒）の指数移動平均（再試行の目安に使う）
+
+    def _fits(self, mb: float) -> bool:
+        if self._active >= self.max_concurrent:
+            return False
+        # 1件で予算を超える見積もりでも、他に何も走っていなければ通す（永久に入れなくなるので）
+        return self._active == 0 or self._reserved_mb + mb <= self.memory_budget_mb
+
+    def _retry_after(self, position: int) -> float:
+        return self._avg_build * (position // self.max_concurrent + 1)
+
+    def acquire(self, mb: float, timeout: float | None = None) -> float:
+        """入れるまで待つ。待った秒数を返す。入れなければ GateBusy"""
+        timeout = self.wait_timeout if timeout is None else timeout
+        t0 = time.monotonic()
+        ticket = object()
+        with self._cond:
+            if not self._waiting and self._fits(mb):
+                self._enter(mb)
+                return 0.0
+            if len(self._waiting) >= self.max_queue:
+                raise GateBusy(self._retry_after(len(self._waiting)), "生成が混み合っています")
+
+            self._waiting.append(ticket)
+            try:
+                deadline = t0 + timeout
+                while not (self._waiting[0] is ticket and self._fits(mb)):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise GateBusy(self._retry_after(self._waiting.index(ticket)), "待ち時間が上限を超えました")
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting.remove(ticket)
+                self._cond.notify_all()
+            self._enter(mb)
+        return time.monotonic() - t0
+
+    def _enter(self, mb: float) -> None:
+        self._active += 1
+        self._reserved_mb += mb
+
+    def release(self, mb: float, build_seconds: float | None = None) -> None:
+        with self._cond:
+            self._active -= 1
+            self._reserved_mb -= mb
+            if build_seconds is not None:
+                self._avg_build = 0.8 * self._avg_build + 0.2 * build_seconds
+            self._cond.notify_all()
+
+    def run(self, fn, payload: dict, timeout: float | None = None):
+        """fn(payload) を入場制限つきで実行し、(戻り値, {"queue_wait": 秒, "build": 秒}) を返す"""
+        mb = estimate_build_mb(payload)
+        wait = self.acquire(mb, timeout)
+        t0 = time.perf_counter()
+        build = None
+        try:
+            result = fn(payload)
+            build = time.perf_counter() - t0
+        finally:
+            self.release(mb, build)
+        return result, {"queue_wait": wait, "build": build}
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {
+                "active": self._active,
+                "waiting": len(self._waiting),
+                "reserved_mb": round(self._reserved_mb, 1),
+                "budget_mb": self.memory_budget_mb,
+                "avg_build": round(self._avg_build, 2),
+            }
+
+
+_default_gate: GenerationGate | None = None
+_default_lock = threading.Lock()
+
+def default_gate() -> GenerationGate:
+    """環境変数の設定でプロセスに1つの GenerationGate を作って返す"""
+    global _default_gate
+    with _default_lock:
+        if _default_gate is None:
+            _default_gate = GenerationGate(
+                max_concurrent=int(os.environ.get("KAMI_MAX_BUILDS") or os.cpu_count() or 1),
+                memory_budget_mb=float(os.environ.get("KAMI_BUILD_MEMORY_MB") or 1024),
+                max_queue=int(os.environ.get("KAMI_BUILD_QUEUE") or 8),
+                wait_timeout=float(os.environ.get("KAMI_BUILD_WAIT") or 30),
+            )
+        return _default_gate
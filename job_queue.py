@@ -0,0 +1,337 @@
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import argparse
+import threading
+import multiprocessing
+
+#---------------------------------------------------------
+# 複数プロセスで共有する鑑定書生成のジョブキュー（SQLite・外部サービス不要）
+#
+#   python job_queue.py worker --processes 4      … ワーカーを起動（CPUの数だけ並べる）
+#   python job_queue.py enqueue payload.json      … ジョブを登録
+#   python job_queue.py status [ID]               … 件数 / 1件の状態
+#
+# - どのアプリ／ワーカーからも同じ DB ファイルを見るので、混んだプロセスに偏らない
+# - 取り出したジョブにはリース（期限）を付け、実行中は延長する。プロセスが落ちて
+#   期限が切れたジョブは次に取り出す人が queued に戻す（再起動しても消えない）
+# - 失敗は max_attempts 回まで間隔を空けて再試行、priority の大きい順に取り出す
+# - 出力先は実行前に result_path として記録するので、再試行でも同じパスに書く
+#---------------------------------------------------------
+
+DEFAULT_LEASE_SECONDS = 120
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_RETRY_DELAY = 5.0     # 再試行までの秒数（回数に比例して延ばす）
+POLL_INTERVAL = 0.5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload      TEXT    NOT NULL,
+    priority     INTEGER NOT NULL DEFAULT 0,
+    status       TEXT    NOT NULL DEFAULT 'queued',   -- queued / running / done / failed
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    available_at REAL    NOT NULL,                    -- この時刻以降に取り出せる（再試行待ち）
+    lease_owner  TEXT,
+    lease_until  REAL,
+    result_path  TEXT,
+    error        TEXT,
+    created_at   REAL    NOT NULL,
+    updated_at   REAL    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_pick ON jobs (status, priority DESC, available_at, id);
+"""
+
+
+def default_db_path() -> str:
+    from build_pdf import OUTPUTS_DIR
+    return os.environ.get("KAMI_JOB_QUEUE") or os.path.join(OUTPUTS_DIR, "_queue", "jobs.sqlite3")
+
+
+class JobQueue:
+    """SQLite（WALモード）のジョブキュー。接続はスレッド・プロセスごとに張り直す"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _tx(self):
+        """書き込みトランザクション（BEGIN IMMEDIATE で取り出しの取り合いを防ぐ）"""
+        return _Transaction(self._conn())
+
+    def enqueue(self, payload: dict, priority: int = 0, max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> int:
+        now = time.time()
+        cur = self._conn().execute(
+            "INSERT INTO jobs (payload, priority, max_attempts, available_at, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (json.dumps(payload, ensure_ascii=False), priority, max_attempts, now, now, now),
+        )
+        return cur.lastrowid
+
+    def _recover_expired(self, conn: sqlite3.Connection, now: float) -> list[sqlite3.Row]:
+        """リースが切れた running を queued に戻す（回数を使い切っていれば failed）。
+        failed にしたジョブの行（payload, result_path）を返す"""
+        dead = conn.execute(
+            "SELECT id, payload, result_path FROM jobs"
+            " WHERE status = 'running' AND lease_until < ? AND attempts >= max_attempts",
+            (now,),
+        ).fetchall()
+        conn.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,"
+            " error = COALESCE(error, 'lease expired'), lease_owner = NULL, lease_until = NULL, updated_at = ?"
+            " WHERE status = 'running' AND lease_until < ?",
+            (now, now),
+        )
+        return dead
+
+    def claim(self, worker_id: str, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> dict | None:
+        """次のジョブを1件取り出してリースを付ける（無ければ None）"""
+        now = time.time()
+        with self._tx() as conn:
+            dead = self._recover_expired(conn, now)
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' AND available_at <= ?"
+                " ORDER BY priority DESC, available_at, id LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_owner = ?,"
+                    " lease_until = ?, updated_at = ? WHERE id = ?",
+                    (worker_id, now + lease_seconds, now, row["id"]),
+                )
+        # 落ちたワーカーが確保したまま残した空の出力ファイルを消す
+        for d in dead:
+            release_reservation(json.loads(d["payload"]), d["result_path"])
+        return self.get(row["id"]) if row is not None else None
+
+    def heartbeat(self, job_id: int, worker_id: str, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> bool:
+        """リースを延長する。他のワーカーに取られていたら False"""
+        now = time.time()
+        cur = self._conn().execute(
+            "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE id = ? AND status = 'running' AND lease_owner = ?",
+            (now + lease_seconds, now, job_id, worker_id),
+        )
+        return cur.rowcount == 1
+
+    def set_result_path(self, job_id: int, worker_id: str, path: str) -> None:
+        self._conn().execute(
+            "UPDATE jobs SET result_path = ?, updated_at = ? WHERE id = ? AND lease_owner = ?",
+            (path, time.time(), job_id, worker_id),
+        )
+
+    def complete(self, job_id: int, worker_id: str, result_path: str) -> bool:
+        cur = self._conn().execute(
+            "UPDATE jobs SET status = 'done', result_path = ?, error = NULL, lease_owner = NULL,"
+            " lease_until = NULL, updated_at = ? WHERE id = ? AND status = 'running' AND lease_owner = ?",
+            (result_path, time.time(), job_id, worker_id),
+        )
+        return cur.rowcount == 1
+
+    def fail(self, job_id: int, worker_id: str, error: str, retry_delay: float = DEFAULT_RETRY_DELAY) -> str | None:
+        """失敗を記録する。回数が残っていれば retry_delay×回数 後に再試行。新しい状態を返す"""
+        now = time.time()
+        with self._tx() as conn:
+            row = conn.execute(
+                "SELECT attempts, max_attempts FROM jobs WHERE id = ? AND status = 'running' AND lease_owner = ?",
+                (job_id, worker_id),
+            ).fetchone()
+            if row is None:
+                return None
+            status = "queued" if row["attempts"] < row["max_attempts"] else "failed"
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, available_at = ?, lease_owner = NULL,"
+                " lease_until = NULL, updated_at = ? WHERE id = ?",
+                (status, error, now + retry_delay * row["attempts"], now, job_id),
+            )
+        return status
+
+    def get(self, job_id: int) -> dict | None:
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def wait(self, job_id: int, timeout: float, poll: float = POLL_INTERVAL) -> dict | None:
+        """done / failed になるか timeout 秒たつまで待って、その時点の状態を返す"""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job["status"] in ("done", "failed") or time.monotonic() >= deadline:
+                return job
+            time.sleep(poll)
+
+    def stats(self) -> dict[str, int]:
+        rows = self._conn().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {r["status"]: r["n"] for r in rows}
+
+    def purge(self, older_than_seconds: float) -> int:
+        """終わったジョブのうち古いものを消す"""
+        cur = self._conn().execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+            (time.time() - older_than_seconds,),
+        )
+        return cur.rowcount
+
+
+class _Transaction:
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+#---------------------------------------------------------
+# ワーカー
+#---------------------------------------------------------
+def release_reservation(payload: dict, path: str | None) -> None:
+    """失敗で終わったジョブが確保した出力ファイル（空のもの）を消す。呼び出し元が出力先を指定していれば触らない"""
+    if not path or payload.get("output_pdf_path"):
+        return
+    from output_store import OutputStore
+    OutputStore(os.path.dirname(path)).release(path)
+
+
+def run_job(queue: JobQueue, job: dict, worker_id: str, lease_seconds: float) -> None:
+    """1件実行する。実行中は別スレッドでリースを延長する"""
+    from build_pdf import build_pdf_from_payload, reserve_output_path
+    from gate import default_gate
+
+    stop = threading.Event()
+
+    def keep_lease():
+        while not stop.wait(lease_seconds / 3):
+            if not queue.heartbeat(job["id"], worker_id, lease_seconds):
+                print(f"⚠ lease lost: job={job['id']} worker={worker_id}")
+                return
+
+    beat = threading.Thread(target=keep_lease, daemon=True)
+    beat.start()
+    payload = dict(job["payload"])
+    path = job["result_path"]
+    try:
+        if not path:
+            path = reserve_output_path(payload)
+            queue.set_result_path(job["id"], worker_id, path)
+        payload["output_pdf_path"] = path
+        # 画面からの生成と同じ入場制限（同時実行数・メモリ見積もり）を通す
+        out, _timings = default_gate().run(build_pdf_from_payload, payload)
+    except Exception as e:
+        stop.set()
+        status = queue.fail(job["id"], worker_id, f"{type(e).__name__}: {e}")
+        print(f"⚠ job failed: job={job['id']} attempt={job['attempts']} status={status} err={e}")
+        if status == "failed":
+            release_reservation(job["payload"], path)
+        return
+    stop.set()
+    queue.complete(job["id"], worker_id, out)
+
+
+def run_worker(db_path: str, worker_id: str | None = None, lease_seconds: float = DEFAULT_LEASE_SECONDS,
+               poll: float = POLL_INTERVAL, stop: threading.Event | None = None, max_jobs: int | None = None) -> int:
+    """キューが空なら poll 秒おきに見に行き、ジョブを順に実行する。実行した件数を返す"""
+    queue = JobQueue(db_path)
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+    stop = stop or threading.Event()
+    done = 0
+    while not stop.is_set() and (max_jobs is None or done < max_jobs):
+        job = queue.claim(worker_id, lease_seconds)
+        if job is None:
+            stop.wait(poll)
+            continue
+        run_job(queue, job, worker_id, lease_seconds)
+        done += 1
+    return done
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="鑑定書生成のジョブキュー（SQLite）")
+    ap.add_argument("--db", default=None, help="キューのDBファイル（既定は KAMI_JOB_QUEUE か outputs/_queue/jobs.sqlite3）")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("worker", help="ワーカーを起動する")
+    p.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="ワーカープロセス数（既定 CPU数）")
+    p.add_argument("--lease", type=float, default=DEFAULT_LEASE_SECONDS, help="リース秒数")
+
+    p = sub.add_parser("enqueue", help="payload の JSON ファイルをジョブとして登録する")
+    p.add_argument("payload_json")
+    p.add_argument("--priority", type=int, default=0)
+    p.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS)
+
+    p = sub.add_parser("status", help="件数、または1件の状態を表示する")
+    p.add_argument("job_id", nargs="?", type=int)
+
+    p = sub.add_parser("purge", help="終わったジョブの古いものを消す")
+    p.add_argument("--days", type=float, default=7)
+
+    args = ap.parse_args(argv)
+    db_path = args.db or default_db_path()
+    queue = JobQueue(db_path)
+
+    if args.cmd == "worker":
+        print(f"✅ ワーカーを {args.processes} プロセス起動します: {db_path}")
+        if args.processes <= 1:
+            run_worker(db_path, lease_seconds=args.lease)
+            return 0
+        procs = [multiprocessing.Process(target=run_worker, args=(db_path,), kwargs={"lease_seconds": args.lease})
+                 for _ in range(args.processes)]
+        for pr in procs:
+            pr.start()
+        try:
+            for pr in procs:
+                pr.join()
+        except KeyboardInterrupt:
+            for pr in procs:
+                pr.terminate()
+        return 0
+
+    if args.cmd == "enqueue":
+        with open(args.payload_json, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        job_id = queue.enqueue(payload, args.priority, args.max_attempts)
+        print(f"✅ 登録しました: job={job_id}")
+        return 0
+
+    if args.cmd == "status":
+        if args.job_id is None:
+            print(json.dumps(queue.stats(), ensure_ascii=False))
+        else:
+            job = queue.get(args.job_id)
+            if job is None:
+                print(f"⚠ ジョブがありません: {args.job_id}")
+                return 1
+            print(json.dumps({k: v for k, v in job.items() if k != "payload"}, ensure_ascii=False, indent=2))
+        return 0
+
+    n = queue.purge(args.days * 86400)
+    print(f"✅ {n} 件を削除しました")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
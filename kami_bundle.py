@@ -0,0 +1,282 @@
+import os
+import io
+import sys
+import json
+import mmap
+import struct
+import hashlib
+import argparse
+
+#---------------------------------------------------------
+# アセットバンドル（assets/ の小さなファイル群を1ファイルにまとめる）
+#
+#   python kami_bundle.py pack assets -o assets.kbundle          … assets/ 全体を1ファイルに
+#   python kami_bundle.py pack assets --per-kami -o bundles/      … 神様ごと + common の複数ファイルに
+#   python kami_bundle.py verify assets.kbundle --against assets  … 中身の検証
+#
+# 形式：
+#   [ヘッダ 32byte] MAGIC(8) | version(u32) | index_offset(u64) | index_length(u64) | 予約(4)
+#   [データ] 各ファイルの中身をそのまま連結（8byte境界に揃える）
+#   [インデックス] JSON {"files": {"kami/1/p1.pdf": [offset, length, mtime, sha256], ...}}
+#
+# 読む側は1回だけ open して mmap し、各ファイルはオフセットで切り出した memoryview
+# （コピーなし）として扱う。ネットワークボリュームで効いていた open/stat の往復がなくなる。
+#---------------------------------------------------------
+
+MAGIC = b"KAMIBNDL"
+VERSION = 1
+HEADER = struct.Struct("<8sIQQ4x")
+ALIGN = 8
+BUNDLE_EXT = ".kbundle"
+
+
+def _relpath(path: str, root: str) -> str:
+    return os.path.relpath(path, root).replace(os.sep, "/")
+
+
+def _walk_files(src_dir: str) -> list[str]:
+    out = []
+    for dirpath, dirnames, filenames in os.walk(src_dir):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        for name in sorted(filenames):
+            if name.startswith(".") or name.endswith(BUNDLE_EXT):
+                continue
+            out.append(os.path.join(dirpath, name))
+    return out
+
+
+def pack(src_dir: str, out_path: str, files: list[str] | None = None) -> dict:
+    """src_dir 以下のファイル（files 指定時はその分だけ）を out_path に詰める。インデックスを返す"""
+    files = files if files is not None else _walk_files(src_dir)
+    index: dict[str, list] = {}
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    tmp = out_path + ".part"
+    with open(tmp, "wb") as out:
+        out.write(b"\0" * HEADER.size)
+        for path in files:
+            pad = -out.tell() % ALIGN
+            if pad:
+                out.write(b"\0" * pad)
+            with open(path, "rb") as f:
+                data = f.read()
+            index[_relpath(path, src_dir)] = [out.tell(), len(data), os.path.getmtime(path),
+                                              hashlib.sha256(data).hexdigest()]
+            out.write(data)
+
+        index_bytes = json.dumps({"files": index}, ensure_ascii=False).encode("utf-8")
+        index_offset = out.tell()
+        out.write(index_bytes)
+        out.seek(0)
+        out.write(HEADER.pack(MAGIC, VERSION, index_offset, len(index_bytes)))
+    os.replace(tmp, out_path)
+    return index
+
+
+def pack_per_kami(src_dir: str, out_dir: str) -> list[str]:
+    """kami/<no>/ ごとに kami_<no>.kbundle、それ以外（fixed, fonts など）を common.kbundle に詰める"""
+    os.makedirs(out_dir, exist_ok=True)
+    groups: dict[str, list[str]] = {}
+    for path in _walk_files(src_dir):
+        parts = _relpath(path, src_dir).split("/")
+        key = f"kami_{parts[1]}" if parts[0] == "kami" and len(parts) > 2 else "common"
+        groups.setdefault(key, []).append(path)
+
+    written = []
+    for key, files in sorted(groups.items()):
+        out_path = os.path.join(out_dir, key + BUNDLE_EXT)
+        pack(src_dir, out_path, files)
+        written.append(out_path)
+    return written
+
+
+class _SliceRaw(io.RawIOBase):
+    """memoryview を読み取り専用ファイルとして見せる（BufferedReader で包んで使う）"""
+
+    def __init__(self, view: memoryview, name: str = ""):
+        self._view = view
+        self._pos = 0
+        self.name = name
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = min(len(b), len(self._view) - self._pos)
+        if n <= 0:
+            return 0
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        else:
+            pos = len(self._view) + offset
+        self._pos = max(0, pos)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+
+class AssetBundle:
+    """1つの .kbundle を mmap して、中のファイルをコピーなしで切り出す"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, index_offset, index_length = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"アセットバンドルではありません: {path}")
+        if version != VERSION:
+            raise ValueError(f"未対応のバンドル形式です (version={version}): {path}")
+        index = json.loads(bytes(self._mmap[index_offset:index_offset + index_length]).decode("utf-8"))
+        self.files: dict[str, list] = index["files"]
+        self._view = memoryview(self._mmap)
+
+    def __contains__(self, relpath: str) -> bool:
+        return relpath in self.files
+
+    def view(self, relpath: str) -> memoryview:
+        offset, length = self.files[relpath][:2]
+        return self._view[offset:offset + length]
+
+    def open(self, relpath: str) -> io.BufferedReader:
+        return io.BufferedReader(_SliceRaw(self.view(relpath), relpath))
+
+    def mtime(self, relpath: str) -> float:
+        return self.files[relpath][2]
+
+    def verify(self, against: str | None = None) -> list[str]:
+        """sha256 と（指定があれば）元フォルダの中身を照合して、問題点のリストを返す"""
+        problems = []
+        end = len(self._mmap)
+        for relpath, (offset, length, _mtime, digest) in sorted(self.files.items()):
+            if offset < HEADER.size or offset + length > end:
+                problems.append(f"範囲外: {relpath}")
+                continue
+            if hashlib.sha256(self.view(relpath)).hexdigest() != digest:
+                problems.append(f"sha256不一致: {relpath}")
+            if against is not None:
+                src = os.path.join(against, *relpath.split("/"))
+                if not os.path.exists(src):
+                    problems.append(f"元ファイルがありません: {relpath}")
+                else:
+                    with open(src, "rb") as f:
+                        if hashlib.sha256(f.read()).hexdigest() != digest:
+                            problems.append(f"元ファイルと不一致: {relpath}")
+        return problems
+
+    def close(self) -> None:
+        self._view.release()
+        self._mmap.close()
+        self._file.close()
+
+
+#---------------------------------------------------------
+# アセットの読み出し口（build_pdf / asset_variants から使う）
+#
+# configure() でバンドルを指定すると、assets_dir 以下のパスはまずバンドルから探す。
+# バンドルに無いもの・未指定のときは今まで通りディスクから読む。
+#---------------------------------------------------------
+_assets_dir: str | None = None
+_bundles: dict[str, AssetBundle] = {}   # relpath → バンドル
+
+
+def configure(assets_dir: str, bundle_paths: str | list[str] | None) -> None:
+    """bundle_paths は .kbundle のパスかそれを含むフォルダ（文字列なら os.pathsep 区切り）"""
+    global _assets_dir
+    _assets_dir = os.path.abspath(assets_dir)
+    _bundles.clear()
+    if not bundle_paths:
+        return
+    if isinstance(bundle_paths, str):
+        bundle_paths = [p for p in bundle_paths.split(os.pathsep) if p]
+    for p in bundle_paths:
+        paths = [os.path.join(p, n) for n in sorted(os.listdir(p)) if n.endswith(BUNDLE_EXT)] if os.path.isdir(p) else [p]
+        for bp in paths:
+            bundle = AssetBundle(bp)
+            for relpath in bundle.files:
+                _bundles.setdefault(relpath, bundle)
+
+
+def _lookup(path: str):
+    if not _bundles or not isinstance(path, str):
+        return None, None
+    relpath = _relpath(os.path.abspath(path), _assets_dir)
+    bundle = _bundles.get(relpath)
+    return (bundle, relpath) if bundle else (None, None)
+
+
+def asset_exists(path: str) -> bool:
+    bundle, _ = _lookup(path)
+    return bundle is not None or os.path.exists(path)
+
+
+def asset_mtime(path: str) -> float:
+    bundle, relpath = _lookup(path)
+    return bundle.mtime(relpath) if bundle else os.path.getmtime(path)
+
+
+def open_asset(path):
+    """PdfReader / ImageReader / Image.open に渡せるもの（バンドル内ならファイル風オブジェクト、無ければパスのまま）"""
+    bundle, relpath = _lookup(path)
+    return bundle.open(relpath) if bundle else path
+
+
+def read_asset(path: str) -> bytes:
+    bundle, relpath = _lookup(path)
+    if bundle:
+        return bytes(bundle.view(relpath))
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="アセットバンドル（.kbundle）の作成・検証")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("pack", help="アセットフォルダを .kbundle に詰める")
+    p.add_argument("src", help="assets/ のパス")
+    p.add_argument("-o", "--out", required=True, help="出力ファイル（--per-kami のときはフォルダ）")
+    p.add_argument("--per-kami", action="store_true", help="神様ごと + common に分けて作る")
+
+    p = sub.add_parser("verify", help=".kbundle の中身を検証する")
+    p.add_argument("bundles", nargs="+")
+    p.add_argument("--against", default=None, help="照合する元の assets/ フォルダ")
+
+    args = ap.parse_args(argv)
+
+    if args.cmd == "pack":
+        if args.per_kami:
+            written = pack_per_kami(args.src, args.out)
+            print(f"✅ {len(written)} 個のバンドルを作成しました: {args.out}")
+        else:
+            index = pack(args.src, args.out)
+            print(f"✅ {len(index)} ファイルを詰めました: {args.out}")
+        return 0
+
+    failed = False
+    for path in args.bundles:
+        bundle = AssetBundle(path)
+        problems = bundle.verify(args.against)
+        if problems:
+            failed = True
+            print(f"⚠ {path}: {len(problems)} 件の問題")
+            for msg in problems:
+                print("   " + msg)
+        else:
+            print(f"✅ {path}: {len(bundle.files)} ファイル OK")
+        bundle.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
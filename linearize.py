@@ -0,0 +1,411 @@
+import io
+import zlib
+import hashlib
+
+from pypdf import PdfWriter
+from pypdf.generic import (
+    ArrayObject,
+    DictionaryObject,
+    EncodedStreamObject,
+    IndirectObject,
+    NameObject,
+    NumberObject,
+    StreamObject,
+    TextStringObject,
+)
+
+#---------------------------------------------------------
+# 線形化（Fast Web View）PDF の書き出し
+#
+# スマホで開いたときに全体のダウンロードを待たず1ページ目を表示できるよう、
+# PDF仕様 Annex F の構成で書き出す（外部コマンド不要）。
+#
+#   %PDF ヘッダ
+#   [2] 線形化パラメータ辞書
+#   [3] 1ページ目用 xref + trailer
+#   [4] カタログ
+#   [5] ヒントストリーム（ページオフセット表・共有オブジェクト表）
+#   [6] 1ページ目のオブジェクト（ページ本体が先頭）      ← /E まで読めば表示できる
+#   [7] 2ページ目以降のオブジェクト（ページごと）
+#   [8] 複数ページで共有するオブジェクト
+#   [9] ページツリー・Info など
+#   [11] メイン xref + trailer
+#
+# オブジェクト番号は [7][8][9] を 1 から、[2][4][5][6] をその後ろに振る。
+#---------------------------------------------------------
+
+_INHERITABLE = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+
+LIN_DICT_RESERVE = 160       # 線形化辞書の予約バイト数（後から値を埋めるため固定長）
+FIRST_TRAILER_RESERVE = 200  # 1ページ目 trailer の予約バイト数
+
+
+def _is_page_node(obj) -> bool:
+    return isinstance(obj, DictionaryObject) and obj.get("/Type") in ("/Page", "/Pages")
+
+
+def _direct_refs(obj) -> list[IndirectObject]:
+    """obj の中に直接書かれている間接参照（参照先はたどらない）"""
+    out = []
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if isinstance(o, IndirectObject):
+            out.append(o)
+        elif isinstance(o, DictionaryObject):
+            for k, v in o.items():
+                if k == "/Length":
+                    continue
+                stack.append(v)
+        elif isinstance(o, ArrayObject):
+            stack.extend(o)
+    return out
+
+
+def _closure(start: IndirectObject) -> list[int]:
+    """start から参照をたどれるオブジェクト（他のページ・ページツリーには入らない）"""
+    seen = {start.idnum}
+    order = [start.idnum]
+    queue = [start]
+    while queue:
+        ref = queue.pop(0)
+        for r in _direct_refs(ref.get_object()):
+            if r.idnum in seen or _is_page_node(r.get_object()):
+                continue
+            seen.add(r.idnum)
+            order.append(r.idnum)
+            queue.append(r)
+    return order
+
+
+class _BitWriter:
+    def __init__(self):
+        self.buf = bytearray()
+        self._acc = 0
+        self._n = 0
+
+    def write(self, value: int, bits: int) -> None:
+        for i in range(bits - 1, -1, -1):
+            self._acc = (self._acc << 1) | ((value >> i) & 1)
+            self._n += 1
+            if self._n == 8:
+                self.buf.append(self._acc)
+                self._acc = 0
+                self._n = 0
+
+    def flush(self) -> None:
+        if self._n:
+            self.buf.append(self._acc << (8 - self._n))
+            self._acc = 0
+            self._n = 0
+
+
+def _nbits(n: int) -> int:
+    return max(0, int(n)).bit_length()
+
+
+class _Serializer:
+    """pypdf のオブジェクトを、振り直した番号で "n 0 obj ... endobj" に書く"""
+
+    def __init__(self, renumber: dict[int, int], overrides: dict[int, dict]):
+        self.renumber = renumber
+        self.overrides = overrides  # idnum → 差し替えるキー（/Parent, /Pages など）
+
+    def _remap(self, obj):
+        if isinstance(obj, IndirectObject):
+            return IndirectObject(self.renumber[obj.idnum], 0, None)
+        if isinstance(obj, DictionaryObject) and not isinstance(obj, StreamObject):
+            d = DictionaryObject()
+            for k, v in obj.items():
+                d[NameObject(k)] = self._remap(v)
+            return d
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self._remap(v) for v in obj)
+        return obj
+
+    def _remap_dict_into(self, src: DictionaryObject, dst: DictionaryObject, extra: dict) -> None:
+        for k, v in src.items():
+            if k == "/Length" or k in extra:
+                continue
+            dst[NameObject(k)] = self._remap(v)
+        for k, v in extra.items():
+            if v is not None:
+                dst[NameObject(k)] = v
+
+    def object_bytes(self, idnum: int, obj) -> bytes:
+        extra = self.overrides.get(idnum, {})
+        if isinstance(obj, StreamObject):
+            out = StreamObject()
+            if isinstance(obj, EncodedStreamObject):
+                data = obj._data
+            else:
+                # 未圧縮のストリームはここで Flate 圧縮する
+                data = zlib.compress(obj.get_data())
+                extra = {**extra, "/Filter": NameObject("/FlateDecode"), "/DecodeParms": None}
+            self._remap_dict_into(obj, out, extra)
+            out._data = data
+            value = out
+        elif isinstance(obj, DictionaryObject):
+            value = DictionaryObject()
+            self._remap_dict_into(obj, value, extra)
+        else:
+            value = self._remap(obj)
+        return self.wrap(self.renumber[idnum], value)
+
+    @staticmethod
+    def wrap(num: int, value) -> bytes:
+        buf = io.BytesIO()
+        buf.write(f"{num} 0 obj\n".encode("ascii"))
+        value.write_to_stream(buf)
+        buf.write(b"\nendobj\n")
+        return buf.getvalue()
+
+
+def _push_inherited(page: DictionaryObject) -> dict:
+    """ページツリーから継承している属性をページに持たせる（ツリーを平らにするため）"""
+    extra = {}
+    parent = page.get("/Parent")
+    while parent is not None:
+        node = parent.get_object()
+        for k in _INHERITABLE:
+            if k not in page and k not in extra and k in node:
+                extra[k] = node[k]
+        parent = node.get("/Parent")
+    return extra
+
+
+def write_linearized(writer: PdfWriter, stream) -> None:
+    """PdfWriter の内容を線形化PDFとして stream に書く"""
+    pages = [p.indirect_reference for p in writer.pages]
+    if not pages:
+        raise ValueError("ページがありません")
+    root_ref = writer.root_object.indirect_reference
+
+    #--- 1) ページごとのオブジェクト集合
+    closures = [_closure(ref) for ref in pages]
+    users: dict[int, set[int]] = {}
+    for i, objs in enumerate(closures):
+        for o in objs:
+            users.setdefault(o, set()).add(i)
+
+    first_page = closures[0]                               # [6]
+    first_set = set(first_page)
+    own_pages: list[list[int]] = [first_page]              # [6] と [7]
+    for i in range(1, len(pages)):
+        own_pages.append([o for o in closures[i] if o not in first_set and users[o] == {i}])
+    shared = []                                            # [8]
+    seen_shared = set()
+    for i in range(1, len(pages)):
+        for o in closures[i]:
+            if o not in first_set and len(users[o]) > 1 and o not in seen_shared:
+                seen_shared.add(o)
+                shared.append(o)
+
+    # カタログからたどれる残り（ページツリー以外）
+    placed = set(users)
+    others = [o for o in _closure(root_ref)[1:] if o not in placed]   # [9]
+
+    # 元のページツリーのノード（平らな1ノードに置き換える）
+    tree_nodes = set()
+    for ref in pages:
+        parent = ref.get_object().get("/Parent")
+        while parent is not None and parent.idnum not in tree_nodes:
+            tree_nodes.add(parent.idnum)
+            parent = parent.get_object().get("/Parent")
+
+    #--- 2) 番号の割り当て
+    # メイン側 1..m-1：[7] → [8] → [9](ページツリー, Info, その他)
+    part7 = [o for objs in own_pages[1:] for o in objs]
+    main_order = part7 + shared
+    renumber: dict[int, int] = {}
+    for o in main_order:
+        renumber[o] = len(renumber) + 1
+    pages_num = len(renumber) + 1
+    info_num = pages_num + 1
+    for j, o in enumerate(others):
+        renumber[o] = info_num + 1 + j
+    m = info_num + 1 + len(others)   # メイン xref の /Size
+    for node in tree_nodes:
+        renumber[node] = pages_num
+
+    # 1ページ目側 m..：線形化辞書, カタログ, ヒント, [6]
+    lin_num = m
+    renumber[root_ref.idnum] = m + 1
+    hint_num = m + 2
+    for o in first_page:
+        renumber[o] = m + 3 + first_page.index(o)
+    size = m + 3 + len(first_page)
+
+    # ページは平らなページツリー（1ノード）にぶら下げる
+    pages_ref = IndirectObject(pages_num, 0, None)
+    overrides: dict[int, dict] = {root_ref.idnum: {"/Pages": pages_ref}}
+    for ref in pages:
+        overrides[ref.idnum] = {"/Parent": pages_ref, **_push_inherited(ref.get_object())}
+    ser = _Serializer(renumber, overrides)
+
+    def obj_bytes(o: int) -> bytes:
+        return ser.object_bytes(o, IndirectObject(o, 0, writer).get_object())
+
+    #--- 3) 本体の書き出し（ヒントストリーム抜きでオフセットを決める）
+    catalog_b = obj_bytes(root_ref.idnum)
+    first_b = [obj_bytes(o) for o in first_page]
+    own_b = [[obj_bytes(o) for o in objs] for objs in own_pages[1:]]
+    shared_b = [obj_bytes(o) for o in shared]
+    kids = ArrayObject(IndirectObject(renumber[r.idnum], 0, None) for r in pages)
+    pages_node = DictionaryObject({
+        NameObject("/Type"): NameObject("/Pages"),
+        NameObject("/Kids"): kids,
+        NameObject("/Count"): NumberObject(len(pages)),
+    })
+    info = DictionaryObject()
+    for k, v in (writer.metadata or {}).items():
+        info[NameObject(k)] = TextStringObject(str(v))
+    tail_b = [ser.wrap(pages_num, pages_node), ser.wrap(info_num, info)] + [obj_bytes(o) for o in others]
+
+    header = b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n"
+    xref1_len = len(f"xref\n{m} {size - m}\n") + 20 * (size - m) + len("trailer\n") + FIRST_TRAILER_RESERVE + len("\nstartxref\n0\n%%EOF\n")
+    lin_len = len(f"{lin_num} 0 obj\n") + LIN_DICT_RESERVE + len("\nendobj\n")
+
+    # ヒントが無い場合の各オフセット（ヒント表の中身はこの値で書く決まり）
+    pos = len(header) + lin_len + xref1_len
+    catalog_off = pos
+    pos += len(catalog_b)
+    hint_insert_at = pos
+    first_offs = []
+    for b in first_b:
+        first_offs.append(pos)
+        pos += len(b)
+    page_offs = [first_offs[0]]
+    page_lens = [pos - first_offs[0]]
+    own_offs = []
+    for objs in own_b:
+        page_offs.append(pos)
+        offs = []
+        for b in objs:
+            offs.append(pos)
+            pos += len(b)
+        own_offs.append(offs)
+        page_lens.append(pos - page_offs[-1])
+    shared_offs = []
+    for b in shared_b:
+        shared_offs.append(pos)
+        pos += len(b)
+
+    #--- 4) ヒントストリーム
+    nobjs = [len(first_page)] + [len(o) for o in own_pages[1:]]
+    shared_ids = {o: i for i, o in enumerate(first_page)}
+    for j, o in enumerate(shared):
+        shared_ids[o] = len(first_page) + j
+    page_shared = [[]] + [[shared_ids[o] for o in closures[i] if o in shared_ids and users[o] != {i}]
+                          for i in range(1, len(pages))]
+    max_id = max([x for refs in page_shared for x in refs], default=0)
+
+    bw = _BitWriter()
+    min_nobj, min_len = min(nobjs), min(page_lens)
+    b_nobj = _nbits(max(nobjs) - min_nobj)
+    b_len = _nbits(max(page_lens) - min_len)
+    b_nshared = _nbits(max(len(r) for r in page_shared))
+    b_sid = _nbits(max_id)
+    for value, bits in ((min_nobj, 32), (page_offs[0], 32), (b_nobj, 16), (min_len, 32), (b_len, 16),
+                        (0, 32), (0, 16), (min_len, 32), (b_len, 16),
+                        (b_nshared, 16), (b_sid, 16), (0, 16), (1, 16)):
+        bw.write(value, bits)
+    for n in nobjs:
+        bw.write(n - min_nobj, b_nobj)
+    bw.flush()
+    for n in page_lens:
+        bw.write(n - min_len, b_len)
+    bw.flush()
+    for refs in page_shared:
+        bw.write(len(refs), b_nshared)
+    bw.flush()
+    for refs in page_shared:
+        for x in refs:
+            bw.write(x, b_sid)
+    bw.flush()
+    bw.flush()   # 分数位置（0bit）
+    bw.flush()   # コンテンツ開始位置（0bit）
+    for n in page_lens:
+        bw.write(n - min_len, b_len)
+    bw.flush()
+    shared_table_at = len(bw.buf)
+
+    group_lens = [len(b) for b in first_b] + [len(b) for b in shared_b]
+    min_glen = min(group_lens)
+    b_glen = _nbits(max(group_lens) - min_glen)
+    first_shared_num = renumber[shared[0]] if shared else 0
+    first_shared_loc = shared_offs[0] if shared else 0
+    for value, bits in ((first_shared_num, 32), (first_shared_loc, 32), (len(first_page), 32),
+                        (len(group_lens), 32), (0, 16), (min_glen, 32), (b_glen, 16)):
+        bw.write(value, bits)
+    for n in group_lens:
+        bw.write(n - min_glen, b_glen)
+    bw.flush()
+    for _ in group_lens:
+        bw.write(0, 1)   # MD5署名なし
+    bw.flush()
+    bw.flush()           # グループ内オブジェクト数-1（0bit）
+
+    hint = StreamObject()
+    hint[NameObject("/S")] = NumberObject(shared_table_at)
+    hint[NameObject("/Filter")] = NameObject("/FlateDecode")
+    hint._data = zlib.compress(bytes(bw.buf))
+    hint_b = ser.wrap(hint_num, hint)
+
+    #--- 5) 実際のオフセット（ヒントの後ろは hint_len だけずれる）
+    hint_len = len(hint_b)
+
+    def actual(off: int) -> int:
+        return off + hint_len if off >= hint_insert_at else off
+
+    first_end = actual(first_offs[-1] + len(first_b[-1]))
+    offsets: dict[int, int] = {lin_num: len(header), renumber[root_ref.idnum]: catalog_off, hint_num: hint_insert_at}
+    for o, off in zip(first_page, first_offs):
+        offsets[renumber[o]] = actual(off)
+    for objs, offs in zip(own_pages[1:], own_offs):
+        for o, off in zip(objs, offs):
+            offsets[renumber[o]] = actual(off)
+    for o, off in zip(shared, shared_offs):
+        offsets[renumber[o]] = actual(off)
+    p = actual(pos)
+    for num, b in zip([pages_num, info_num] + [renumber[o] for o in others], tail_b):
+        offsets[num] = p
+        p += len(b)
+    main_xref_off = p
+    main_xref = [f"xref\n0 {m}\n0000000000 65535 f \n".encode("ascii")]
+    for num in range(1, m):
+        main_xref.append(f"{offsets[num]:010d} 00000 n \n".encode("ascii"))
+    first_xref_off = len(header) + lin_len
+    main_tail = b"".join(main_xref) + f"trailer\n<< /Size {m} >>\nstartxref\n{first_xref_off}\n%%EOF\n".encode("ascii")
+    total_len = main_xref_off + len(main_tail)
+    space_before_first_entry = main_xref_off + len(f"xref\n0 {m}")
+
+    #--- 6) 固定長部分（線形化辞書・1ページ目 xref）
+    lin = (f"<< /Linearized 1 /L {total_len} /H [ {hint_insert_at} {hint_len} ] /O {renumber[first_page[0]]}"
+           f" /E {first_end} /N {len(pages)} /T {space_before_first_entry} >>")
+    lin_b = f"{lin_num} 0 obj\n{lin.ljust(LIN_DICT_RESERVE)}\nendobj\n".encode("ascii")
+
+    doc_id = hashlib.md5(b"".join(first_b[:1]) + str(total_len).encode("ascii")).hexdigest()
+    trailer = (f"<< /Size {size} /Prev {main_xref_off} /Root {renumber[root_ref.idnum]} 0 R"
+               f" /Info {info_num} 0 R /ID [ <{doc_id}> <{doc_id}> ] >>")
+    xref1 = [f"xref\n{m} {size - m}\n".encode("ascii")]
+    for num in range(m, size):
+        xref1.append(f"{offsets[num]:010d} 00000 n \n".encode("ascii"))
+    xref1_b = b"".join(xref1) + f"trailer\n{trailer.ljust(FIRST_TRAILER_RESERVE)}\nstartxref\n0\n%%EOF\n".encode("ascii")
+    assert len(lin_b) == lin_len and len(xref1_b) == xref1_len
+
+    stream.write(header)
+    stream.write(lin_b)
+    stream.write(xref1_b)
+    stream.write(catalog_b)
+    stream.write(hint_b)
+    for b in first_b:
+        stream.write(b)
+    for objs in own_b:
+        for b in objs:
+            stream.write(b)
+    for b in shared_b:
+        stream.write(b)
+    for b in tail_b:
+        stream.write(b)
+    stream.write(main_tail)
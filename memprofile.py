@@ -0,0 +1,192 @@
+import os
+import sys
+import time
+import contextlib
+import tracemalloc
+
+#---------------------------------------------------------
+# 鑑定書生成のメモリプロファイル（必要なときだけ有効にする）
+#
+#   with MemoryProfile() as prof:
+#       build_pdf_bytes(payload)
+#   print(prof.report())
+#   open("flame.txt", "w").write(prof.flame())   # flamegraph.pl / speedscope に読ませる
+#
+# build_pdf の各段階の終わりで mark_stage("p11") などを呼んでいるので、
+# 前の mark から増えた分（tracemalloc の差分とピーク・RSS）をその段階の分として記録する。
+# asset_scope("photo", path) で囲んだ読み込みは、アセットごとに残ったメモリを記録する。
+# プロファイル中でなければどちらも何もしない。tracemalloc はプロセス全体なので同時に1件だけ測る。
+# bench.py memory から合成アセットで回せる。
+#---------------------------------------------------------
+
+MB = 1024 * 1024
+
+_active: "MemoryProfile | None" = None
+
+
+def rss_mb() -> float | None:
+    """現在のRSS（MB）。取れない環境では None"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / MB
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_mb() -> float | None:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS は byte
+    return peak / MB if sys.platform == "darwin" else peak / 1024
+
+
+def mark_stage(name: str) -> None:
+    """段階 name の終わり（build_pdf から呼ぶ）"""
+    if _active is not None:
+        _active.mark(name)
+
+
+def asset_scope(kind: str, path):
+    """アセットの読み込み・描画を囲む（build_pdf から呼ぶ）"""
+    if _active is None:
+        return contextlib.nullcontext()
+    return _active.asset(kind, path if isinstance(path, str) else "(memory)")
+
+
+def _site(frame) -> str:
+    return f"{os.path.basename(frame.filename)}:{frame.lineno}"
+
+
+class MemoryProfile:
+    """tracemalloc のスナップショットと RSS を段階ごとに記録する
+
+    stacks=True で呼び出し元まで記録する（flame() 用）。深いトレースは生成が数倍遅くなるので、
+    ふだんは確保した行だけを記録する。
+    """
+
+    def __init__(self, stacks: bool = False, frames: int = 25, top: int = 5):
+        self.stacks = stacks
+        self.frames = frames if stacks else 1
+        self.top = top
+        self.stages: list[dict] = []
+        self.assets: dict[tuple[str, str], dict] = {}
+        self._stacks: list[tuple[str, tuple[str, ...], int]] = []
+        self._started_tracing = False
+
+    def _snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ])
+
+    def __enter__(self) -> "MemoryProfile":
+        global _active
+        if _active is not None:
+            raise RuntimeError("MemoryProfile は同時に1つだけ使えます")
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracing = True
+        tracemalloc.reset_peak()
+        self._prev_snapshot = self._snapshot()
+        self._prev_traced = tracemalloc.get_traced_memory()[0]
+        self._base_traced = self._prev_traced
+        self._t = time.perf_counter()
+        _active = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        global _active
+        _active = None
+        if self._started_tracing:
+            tracemalloc.stop()
+
+    def mark(self, name: str) -> None:
+        now = time.perf_counter()
+        current, peak = tracemalloc.get_traced_memory()
+        snap = self._snapshot()
+        diff = snap.compare_to(self._prev_snapshot, "traceback" if self.stacks else "lineno")
+        top = []
+        for stat in diff:
+            if stat.size_diff <= 0:
+                continue
+            stack = tuple(_site(f) for f in stat.traceback)
+            if self.stacks:
+                self._stacks.append((name, stack, stat.size_diff))
+            if len(top) < self.top:
+                top.append({"site": stack[-1], "kb": stat.size_diff / 1024})
+        self.stages.append({
+            "stage": name,
+            "seconds": now - self._t,
+            "delta_mb": (current - self._prev_traced) / MB,
+            "traced_mb": (current - self._base_traced) / MB,
+            "peak_mb": (peak - self._base_traced) / MB,
+            "rss_mb": rss_mb(),
+            "top": top,
+        })
+        tracemalloc.reset_peak()
+        self._prev_snapshot = snap
+        self._prev_traced = current
+        self._t = time.perf_counter()
+
+    @contextlib.contextmanager
+    def asset(self, kind: str, path: str):
+        before = tracemalloc.get_traced_memory()[0]
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            a = self.assets.setdefault((kind, path), {"kind": kind, "path": path, "count": 0,
+                                                      "retained_mb": 0.0, "seconds": 0.0})
+            a["count"] += 1
+            a["retained_mb"] += (tracemalloc.get_traced_memory()[0] - before) / MB
+            a["seconds"] += time.perf_counter() - t0
+
+    @property
+    def peak_mb(self) -> float:
+        """プロファイル開始時からの tracemalloc ピーク（MB）"""
+        return max((s["peak_mb"] for s in self.stages), default=0.0)
+
+    def to_dict(self) -> dict:
+        return {
+            "peak_mb": self.peak_mb,
+            "stages": self.stages,
+            "assets": sorted(self.assets.values(), key=lambda a: -a["retained_mb"]),
+        }
+
+    def report(self, top_assets: int = 15) -> str:
+        lines = [f"{'stage':<10} {'time[ms]':>9} {'delta[MB]':>10} {'held[MB]':>9} {'peak[MB]':>9} {'RSS[MB]':>8}  主な確保元"]
+        for s in self.stages:
+            rss = f"{s['rss_mb']:.0f}" if s["rss_mb"] is not None else "-"
+            sites = ", ".join(f"{t['site']}({t['kb']:.0f}KB)" for t in s["top"][:3])
+            lines.append(f"{s['stage']:<10} {s['seconds'] * 1000:>9.1f} {s['delta_mb']:>+10.2f} {s['traced_mb']:>9.2f} "
+                         f"{s['peak_mb']:>9.2f} {rss:>8}  {sites}")
+        lines.append(f"\nピーク（tracemalloc）: {self.peak_mb:.2f} MB")
+
+        assets = sorted(self.assets.values(), key=lambda a: -a["retained_mb"])[:top_assets]
+        if assets:
+            lines.append(f"\n{'asset':<9} {'count':>5} {'kept[MB]':>9} {'time[ms]':>9}  path")
+            for a in assets:
+                lines.append(f"{a['kind']:<9} {a['count']:>5} {a['retained_mb']:>9.2f} {a['seconds'] * 1000:>9.1f}  {a['path']}")
+        return "\n".join(lines)
+
+    def flame(self) -> str:
+        """段階;呼び出し元;…;確保元 バイト数 の collapsed stack 形式（stacks=True のときだけ中身がある）"""
+        merged: dict[str, int] = {}
+        for stage, stack, size in self._stacks:
+            key = ";".join((stage,) + stack)
+            merged[key] = merged.get(key, 0) + size
+        return "\n".join(f"{k} {v}" for k, v in sorted(merged.items())) + "\n"
+
+
+def profile_build(payload: dict, fn=None) -> MemoryProfile:
+    """payload を1件生成してプロファイルを返す（fn 省略時は build_pdf_bytes）"""
+    if fn is None:
+        from build_pdf import build_pdf_bytes as fn
+    with MemoryProfile() as prof:
+        fn(payload)
+    return prof
@@ -0,0 +1,105 @@
+import os
+import re
+import uuid
+from datetime import date
+
+
+def sanitize_filename_component(text: str) -> str:
+    """ファイル名に使えない文字（フォルダ区切りなど）を _ に置き換える"""
+    if text is None:
+        return ""
+    text = text.strip()
+    text = re.sub(r'[\\/:*?"<>|]+', "_", text)
+    text = re.sub(r"_+", "_", text)
+    return text
+
+
+def atomic_write(path: str, write_fn) -> str:
+    """同じフォルダの一時ファイルに書いてから os.replace で差し替える（書きかけのPDFを見せない）"""
+    tmp = f"{path}.{uuid.uuid4().hex[:8]}.part"
+    try:
+        with open(tmp, "wb") as f:
+            write_fn(f)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return path
+
+
+class OutputStore:
+    """outputs/ 以下の保存先を払い出す
+
+    - ファイルは作成日ごとのサブフォルダ root/YYYY/MM/DD/ に分けて置く
+      （outputs/ が数十万件になってもフォルダ操作が遅くならないように）
+    - 同名の連番 (1), (2)… は os.path.exists で順に探さず、
+      フォルダ内の .index/<ファイル名>.next に持っている次番号から決める
+    - 名前の確保は O_CREAT|O_EXCL の排他作成で行うので、
+      複数セッションが同じパスを取ることはない（カウンタはあくまでヒント）
+    """
+
+    INDEX_DIR = ".index"
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def shard_dir(self, created: date | None = None) -> str:
+        created = created or date.today()
+        return os.path.join(self.root, f"{created.year:04d}", f"{created.month:02d}", f"{created.day:02d}")
+
+    @staticmethod
+    def numbered_name(filename: str, i: int) -> str:
+        """0 → そのまま、1以上 → name(i).ext"""
+        if i == 0:
+            return filename
+        base, ext = os.path.splitext(filename)
+        return f"{base}({i}){ext}"
+
+    def _counter_path(self, directory: str, filename: str) -> str:
+        return os.path.join(directory, self.INDEX_DIR, filename + ".next")
+
+    def _read_counter(self, counter_path: str) -> int:
+        try:
+            with open(counter_path, "r", encoding="utf-8") as f:
+                return max(0, int(f.read().strip() or 0))
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_counter(self, counter_path: str, n: int) -> None:
+        os.makedirs(os.path.dirname(counter_path), exist_ok=True)
+        # 他のセッションが先に進めていたら巻き戻さない
+        n = max(n, self._read_counter(counter_path))
+        atomic_write(counter_path, lambda f: f.write(str(n).encode("ascii")))
+
+    def peek(self, filename: str, created: date | None = None) -> str:
+        """次に払い出す予定のパス（表示用。確保はしない）"""
+        directory = self.shard_dir(created)
+        i = self._read_counter(self._counter_path(directory, filename))
+        return os.path.join(directory, self.numbered_name(filename, i))
+
+    def reserve(self, filename: str, created: date | None = None) -> str:
+        """空ファイルを排他作成して保存先を確保し、そのパスを返す"""
+        directory = self.shard_dir(created)
+        os.makedirs(directory, exist_ok=True)
+        counter_path = self._counter_path(directory, filename)
+
+        i = self._read_counter(counter_path)
+        while True:
+            path = os.path.join(directory, self.numbered_name(filename, i))
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                i += 1
+                continue
+            os.close(fd)
+            self._write_counter(counter_path, i + 1)
+            return path
+
+    def release(self, path: str) -> None:
+        """生成に失敗したとき、確保しただけの空ファイルを消す"""
+        try:
+            if os.path.getsize(path) == 0:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,138 @@
+import os
+import sys
+import time
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+import build_pdf
+from build_pdf import (
+    get_effective_year_month, year_page, month_page, personal_year_page, month_title_page,
+)
+
+#---------------------------------------------------------
+# 時期で決まるおまけページを切り替わり前に作り置きする
+#
+#   python prerender.py                 … 今と LEAD_DAYS 日後の分を作る（作り置き済みは飛ばす）
+#   python prerender.py --at 2026-12-19 … 指定日時点の分を作る
+#   python prerender.py --loop          … 常駐して定期的に作る（app.py からはスレッドで起動）
+#
+# 対象（1時点あたり20ページ）：
+#   「{年}年のご守護は」1枚 / 「{年}年{月}月のご守護は」1枚 /
+#   「{年}年のあなたのご守護は」9枚 / omake_month1.pdf に年月を重ねたページ 9枚
+# 月は get_effective_year_month（20日以降は翌月）で決まるので、20日や1月1日を
+# またいだ直後に全員のビルドが同じページを作り直していたのをここで先に済ませておく。
+#---------------------------------------------------------
+
+LEAD_DAYS = 3                 # 切り替わりの何日前から次の分を作っておくか
+DEFAULT_INTERVAL = 60 * 60    # 常駐時の確認間隔（秒）
+PERSONAL_KAMI_NOS = range(1, 10)   # reduce_1_9 の結果（運命の神様から決まる9通り）
+
+
+def periods(now: datetime | None = None, lead_days: int = LEAD_DAYS) -> list[tuple[int, int, int]]:
+    """作り置きが必要な (暦の年, 有効年, 有効月) の一覧（今と lead_days 日後。重複は除く）"""
+    now = now or datetime.now()
+    out = []
+    for t in (now, now + timedelta(days=lead_days)):
+        key = (t.year, *get_effective_year_month(t))
+        if key not in out:
+            out.append(key)
+    return out
+
+
+def page_names(year: int, y_eff: int, m_eff: int) -> list[str]:
+    names = [f"year_{year}.pdf", f"month_{y_eff}-{m_eff:02d}.pdf"]
+    names += [f"personal_year_{year}_{k}.pdf" for k in PERSONAL_KAMI_NOS]
+    names += [f"month_title_{y_eff}-{m_eff:02d}_{k}.pdf" for k in PERSONAL_KAMI_NOS]
+    return names
+
+
+def prerender_period(year: int, y_eff: int, m_eff: int, force: bool = False) -> None:
+    year_page(year, force)
+    month_page(y_eff, m_eff, force)
+    for k in PERSONAL_KAMI_NOS:
+        personal_year_page(year, k, force)
+        month_title_page(y_eff, m_eff, k, force)
+
+
+def prune(keep: set[str]) -> int:
+    """もう使わない時期の作り置きを消す（作業中の .part は残す）"""
+    removed = 0
+    try:
+        names = os.listdir(build_pdf.PRERENDER_DIR)
+    except FileNotFoundError:
+        return 0
+    for name in names:
+        if name.endswith(".pdf") and name not in keep:
+            try:
+                os.remove(os.path.join(build_pdf.PRERENDER_DIR, name))
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def prerender_all(now: datetime | None = None, force: bool = False, lead_days: int = LEAD_DAYS,
+                  prune_old: bool = True) -> dict:
+    """今と lead_days 日後の分を作り置きし、（prune_old なら）古い分を消す"""
+    t0 = time.perf_counter()
+    keep: set[str] = set()
+    for year, y_eff, m_eff in periods(now, lead_days):
+        prerender_period(year, y_eff, m_eff, force)
+        keep.update(page_names(year, y_eff, m_eff))
+    pages = len(keep)
+    # 切り替わり直後にビルド中のものが読めなくならないよう、1日前の分までは残す
+    for year, y_eff, m_eff in periods((now or datetime.now()) - timedelta(days=1), 0):
+        keep.update(page_names(year, y_eff, m_eff))
+    removed = prune(keep) if prune_old else 0
+    return {"pages": pages, "removed": removed, "seconds": time.perf_counter() - t0}
+
+
+def run_scheduler(interval: float = DEFAULT_INTERVAL, stop: threading.Event | None = None) -> None:
+    """interval 秒ごとに prerender_all を呼ぶ（作り置き済みなら stat だけで終わる）"""
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        try:
+            prerender_all()
+        except Exception as e:
+            print(f"⚠ prerender error: {e}")
+        stop.wait(interval)
+
+
+_scheduler_lock = threading.Lock()
+_scheduler_thread: threading.Thread | None = None
+
+def start_background(interval: float = DEFAULT_INTERVAL) -> threading.Thread:
+    """プロセスに1つだけ常駐スレッドを起動する（app.py から呼ぶ）"""
+    global _scheduler_thread
+    with _scheduler_lock:
+        if _scheduler_thread is None or not _scheduler_thread.is_alive():
+            _scheduler_thread = threading.Thread(target=run_scheduler, args=(interval,),
+                                                 name="kami-prerender", daemon=True)
+            _scheduler_thread.start()
+        return _scheduler_thread
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="時期で決まるおまけページを作り置きします")
+    ap.add_argument("--at", default=None, help="この日時点の分を作る（YYYY-MM-DD。省略時は今）")
+    ap.add_argument("--lead-days", type=int, default=LEAD_DAYS, help=f"何日後の分まで作るか（既定 {LEAD_DAYS}）")
+    ap.add_argument("--force", action="store_true", help="作り置き済みでも作り直す")
+    ap.add_argument("--loop", action="store_true", help="常駐して定期的に作る")
+    ap.add_argument("--interval", type=float, default=DEFAULT_INTERVAL, help="--loop の確認間隔（秒）")
+    args = ap.parse_args(argv)
+
+    if args.loop:
+        print(f"✅ 作り置きを常駐で実行します（{args.interval:.0f}秒ごと）: {build_pdf.PRERENDER_DIR}")
+        run_scheduler(args.interval)
+        return 0
+
+    now = datetime.fromisoformat(args.at) if args.at else None
+    # --at で別の日を指定したときは、今使っている分を消さない
+    r = prerender_all(now, args.force, args.lead_days, prune_old=now is None)
+    print(f"✅ 作り置き {r['pages']} ページ（削除 {r['removed']}）{r['seconds']:.2f}秒: {build_pdf.PRERENDER_DIR}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+from pypdf import PdfWriter
+from pypdf.generic import (
+    ArrayObject, DecodedStreamObject, DictionaryObject, EncodedStreamObject, FloatObject,
+    IndirectObject, NameObject, StreamObject,
+)
+
+#---------------------------------------------------------
+# overlay を Form XObject として base ページに「押す」
+#
+# pypdf の page.merge_page は両ページのリソース名を付け替えてマージし、
+# base の内容ストリームもパースして書き直すので、base が複雑なほど遅い。
+# ここでは
+#   - overlay ページ（reportlab で作った1ページ）を自分のリソースごと Form XObject にし、
+#   - base の /Contents を [q, 元の内容..., Q q /<名前> Do Q] に差し替える
+# だけにする。元の内容ストリームはバイト列のまま触らないので、時間は base の複雑さによらない。
+# Form XObject は自分の /Resources を持つので、overlay 側のリソース名の付け替えも要らない。
+#---------------------------------------------------------
+
+STAMP_PREFIX = "/KamiStamp"
+
+_stamp_name_cache: dict[tuple, str] = {}
+
+
+def _xobject_names(page) -> set[str]:
+    res = page.get("/Resources")
+    res = res.get_object() if res is not None else {}
+    xo = res.get("/XObject")
+    return set(xo.get_object().keys()) if xo is not None else set()
+
+
+def stamp_name(page, cache_key=None) -> str:
+    """base ページの /XObject と重ならない名前（cache_key を渡せばテンプレートごとに1回だけ調べる）"""
+    if cache_key is not None and cache_key in _stamp_name_cache:
+        return _stamp_name_cache[cache_key]
+    used = _xobject_names(page)
+    i = 0
+    while f"{STAMP_PREFIX}{i}" in used:
+        i += 1
+    name = f"{STAMP_PREFIX}{i}"
+    if cache_key is not None:
+        _stamp_name_cache[cache_key] = name
+    return name
+
+
+def _raw_stream(data: bytes) -> DecodedStreamObject:
+    s = DecodedStreamObject()
+    s.set_data(data)
+    return s
+
+
+def overlay_form(writer: PdfWriter, overlay_page) -> IndirectObject:
+    """overlay ページを writer 内の Form XObject にして参照を返す"""
+    contents = overlay_page.get("/Contents")
+    contents = contents.get_object() if contents is not None else None
+    if isinstance(contents, StreamObject) and contents.get("/Filter") is not None:
+        # 圧縮済みの中身をそのまま使う（展開・再圧縮しない）
+        form = EncodedStreamObject()
+        form._data = contents._data
+        for key in ("/Filter", "/DecodeParms"):
+            if key in contents:
+                form[NameObject(key)] = contents[key].clone(writer)
+    else:
+        if isinstance(contents, StreamObject):
+            data = contents.get_data()
+        elif contents is not None:
+            data = b"\n".join(s.get_object().get_data() for s in contents)
+        else:
+            data = b""
+        form = _raw_stream(data)
+
+    box = overlay_page.mediabox
+    form[NameObject("/Type")] = NameObject("/XObject")
+    form[NameObject("/Subtype")] = NameObject("/Form")
+    form[NameObject("/BBox")] = ArrayObject(FloatObject(v) for v in (box.left, box.bottom, box.right, box.top))
+    res = overlay_page.get("/Resources")
+    if res is not None:
+        form[NameObject("/Resources")] = res.clone(writer)
+    return writer._add_object(form)
+
+
+def stamp_page(writer: PdfWriter, page, overlay_page, name: str) -> None:
+    """writer に追加済みの base ページ page に overlay_page を押す（page をその場で書き換える）"""
+    form_ref = overlay_form(writer, overlay_page)
+
+    res = page.get("/Resources")
+    if res is None:
+        res = DictionaryObject()
+        page[NameObject("/Resources")] = res
+    else:
+        res = res.get_object()
+    xo = res.get("/XObject")
+    if xo is None:
+        xo = DictionaryObject()
+        res[NameObject("/XObject")] = xo
+    else:
+        xo = xo.get_object()
+    xo[NameObject(name)] = form_ref
+
+    orig = page.get("/Contents")
+    if orig is None:
+        items = []
+    else:
+        obj = orig.get_object()
+        items = list(obj) if isinstance(obj, ArrayObject) else [orig]
+    pre = writer._add_object(_raw_stream(b"q\n"))
+    post = writer._add_object(_raw_stream(f"\nQ\nq\n{name} Do\nQ\n".encode("ascii")))
+    page[NameObject("/Contents")] = ArrayObject([pre, *items, post])
@@ -0,0 +1,216 @@
+import io
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+from pypdf import PdfReader
+from pypdf.generic import DictionaryObject, IndirectObject, NameObject, NullObject, PdfObject, TextStringObject
+
+from linearize import _Serializer, _closure
+
+#---------------------------------------------------------
+# 結合しながら書き出す（PdfWriter を使わない最終結合）
+#
+# PdfWriter に全パートのページを add_page してから write すると、
+# 全パートの PdfReader とページツリーが最後まで同時にメモリに残る。
+# ここではパートを1つずつ
+#   1) PdfReader で開き、各ページからたどれるオブジェクトをバイト列（PartTemplate）にし、
+#   2) オブジェクト番号をずらして出力にすぐ書き、
+#   3) PdfReader を捨てる
+# ので、メモリに残るのは「今のパート1つ」と各オブジェクトの位置（xref 用）だけになる。
+#
+# PartTemplate の中の参照は番号を入れる位置だけ覚えておき、書くときに差し込む。
+# 固定のパート（assets の共通ページ・神様ページ）は PartTemplate をキャッシュして、
+# 2件目からはパースも直列化もせずバイト列をコピーするだけにする。
+#
+# 出力のオブジェクト番号： 1 ページツリー、2 カタログ、3〜 パートのオブジェクト（、最後に Info）
+#---------------------------------------------------------
+
+PAGES_NUM = 1
+CATALOG_NUM = 2
+HEADER = b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n"
+
+# 固定パートのキャッシュ上限（MB）
+TEMPLATE_CACHE_MB = float(os.environ.get("KAMI_TEMPLATE_CACHE_MB") or 32)
+
+
+class _Ref(PdfObject):
+    """PartTemplate 内の参照。書いた位置と（パート内の）番号を記録するだけで何も書かない"""
+
+    def __init__(self, local: int, refs: list):
+        self.local = local
+        self.refs = refs
+
+    def write_to_stream(self, stream, encryption_key=None) -> None:
+        self.refs.append((stream.tell(), self.local))
+
+
+class _TemplateSerializer(_Serializer):
+    """linearize._Serializer の直列化で、参照を _Ref にしてパート内の番号で書く"""
+
+    def __init__(self, local: dict[int, int]):
+        super().__init__(local, {})
+        self.refs: list[tuple[int, int]] = []
+
+    def _remap(self, obj):
+        if isinstance(obj, IndirectObject):
+            local = self.renumber.get(obj.idnum)
+            # 他のパートのページ（リンク先など）はたどれないので null にする
+            return _Ref(local, self.refs) if local else NullObject()
+        return super()._remap(obj)
+
+    def wrap(self, num: int, value) -> bytes:
+        buf = io.BytesIO()
+        value.write_to_stream(buf)
+        buf.write(b"\nendobj\n")
+        return buf.getvalue()
+
+    def body(self, idnum: int, obj) -> tuple[bytes, list[tuple[int, int]]]:
+        self.refs = []
+        return self.object_bytes(idnum, obj), self.refs
+
+
+class PartTemplate:
+    """1パート分のオブジェクト（"n 0 obj" を除いたバイト列と参照の位置）とページの番号"""
+
+    def __init__(self, objects: list[tuple[bytes, list[tuple[int, int]]]], pages: list[int]):
+        self.objects = objects
+        self.pages = pages
+        self.nbytes = sum(len(b) for b, _ in objects)
+
+
+def part_template(source) -> PartTemplate:
+    """source（PDFのパス or ファイル風オブジェクト）を PartTemplate にする"""
+    reader = PdfReader(source)
+    page_refs = [p.indirect_reference for p in reader.pages]
+
+    # パート内の番号：全ページを先に振ってから、ページ間の参照（注釈の /P など）も解決できるようにする
+    local: dict[int, int] = {}
+    order: list[int] = []
+    for ref in page_refs:
+        for o in _closure(ref):
+            if o not in local:
+                local[o] = len(local) + 1
+                order.append(o)
+
+    ser = _TemplateSerializer(local)
+    page_ids = {ref.idnum for ref in page_refs}
+    objects = []
+    for o in order:
+        obj = reader.get_object(o)
+        if o in page_ids:
+            # ページは出力のページツリーにぶら下げる
+            ser.overrides = {o: {"/Parent": IndirectObject(PAGES_NUM, 0, None)}}
+        objects.append(ser.body(o, obj))
+        ser.overrides = {}
+    return PartTemplate(objects, [local[ref.idnum] for ref in page_refs])
+
+
+_cache: OrderedDict = OrderedDict()
+_cache_bytes = 0
+_cache_lock = threading.Lock()
+
+
+def cached_part_template(source, cache_key=None) -> PartTemplate:
+    """cache_key（(パス, 更新時刻) など）があれば PartTemplate をキャッシュして使い回す"""
+    global _cache_bytes
+    if cache_key is None:
+        return part_template(source)
+    with _cache_lock:
+        t = _cache.get(cache_key)
+        if t is not None:
+            _cache.move_to_end(cache_key)
+            return t
+
+    t = part_template(source)
+    with _cache_lock:
+        if cache_key not in _cache:
+            _cache[cache_key] = t
+            _cache_bytes += t.nbytes
+        while _cache_bytes > TEMPLATE_CACHE_MB * 1024 * 1024 and len(_cache) > 1:
+            _, old = _cache.popitem(last=False)
+            _cache_bytes -= old.nbytes
+    return t
+
+
+def clear_template_cache() -> None:
+    global _cache_bytes
+    with _cache_lock:
+        _cache.clear()
+        _cache_bytes = 0
+
+
+class StreamingPdfWriter:
+    """パートを受け取った順に stream へ書いていく。最後に close() でページツリーと xref を書く"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._pos = 0
+        self._offsets: dict[int, int] = {}
+        self._next = CATALOG_NUM + 1
+        self._kids: list[int] = []
+        self._md5 = hashlib.md5()
+        self._write(HEADER)
+
+    def _write(self, data: bytes) -> None:
+        self.stream.write(data)
+        self._pos += len(data)
+
+    def _begin(self, num: int) -> None:
+        self._offsets[num] = self._pos
+        self._write(f"{num} 0 obj\n".encode("ascii"))
+
+    @property
+    def page_count(self) -> int:
+        return len(self._kids)
+
+    def add_template(self, t: PartTemplate) -> None:
+        base = self._next - 1
+        for i, (body, refs) in enumerate(t.objects, 1):
+            self._begin(base + i)
+            start = 0
+            for at, local in refs:
+                self._write(body[start:at])
+                self._write(f"{base + local} 0 R".encode("ascii"))
+                start = at
+            self._write(body[start:])
+        if t.objects:
+            self._md5.update(t.objects[0][0][:256])
+        self._kids.extend(base + p for p in t.pages)
+        self._next += len(t.objects)
+
+    def add_part(self, source, cache_key=None) -> None:
+        """source の全ページを書く（source の PdfReader はここを出たら残らない）"""
+        self.add_template(cached_part_template(source, cache_key))
+
+    def close(self, metadata: dict | None = None) -> None:
+        if not self._kids:
+            raise ValueError("ページがありません")
+        kids = " ".join(f"{k} 0 R" for k in self._kids)
+        self._begin(PAGES_NUM)
+        self._write(f"<< /Type /Pages /Kids [ {kids} ] /Count {len(self._kids)} >>\nendobj\n".encode("ascii"))
+        self._begin(CATALOG_NUM)
+        self._write(f"<< /Type /Catalog /Pages {PAGES_NUM} 0 R >>\nendobj\n".encode("ascii"))
+
+        info = ""
+        if metadata:
+            d = DictionaryObject({NameObject(k): TextStringObject(str(v)) for k, v in metadata.items()})
+            buf = io.BytesIO()
+            d.write_to_stream(buf)
+            info_num = self._next
+            self._next += 1
+            self._begin(info_num)
+            self._write(buf.getvalue() + b"\nendobj\n")
+            info = f" /Info {info_num} 0 R"
+
+        size = self._next
+        xref_at = self._pos
+        lines = [f"xref\n0 {size}\n0000000000 65535 f \n"]
+        for num in range(1, size):
+            lines.append(f"{self._offsets[num]:010d} 00000 n \n")
+        self._md5.update(str(self._pos).encode("ascii"))
+        doc_id = self._md5.hexdigest()
+        lines.append(f"trailer\n<< /Size {size} /Root {CATALOG_NUM} 0 R{info} /ID [ <{doc_id}> <{doc_id}> ] >>\n"
+                     f"startxref\n{xref_at}\n%%EOF\n")
+        self._write("".join(lines).encode("ascii"))
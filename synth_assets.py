@@ -0,0 +1,112 @@
+"""ベンチ・負荷試験用の合成アセットツリーを作る（本番アセットなしでオフライン実行するため）"""
+import os
+import sys
+import json
+import shutil
+import argparse
+
+from PIL import Image, ImageDraw
+from reportlab.pdfgen import canvas
+from reportlab.lib.utils import ImageReader
+import reportlab
+
+PAGE_SIZE = (960, 540)   # 本番テンプレートと同じ横長スライド想定
+KAMI_COUNT = 12
+
+ROLE_FILES = ["tenmei.pdf", "syukumei.pdf", "shimei.pdf", "unmei.pdf"]
+
+
+def _fallback_font() -> str:
+    return os.path.join(os.path.dirname(reportlab.__file__), "fonts", "Vera.ttf")
+
+
+def _make_photo(path: str, seed: int, size: tuple[int, int] = (600, 800)) -> None:
+    """透過付きの神様カード画像（photo.png 相当）"""
+    w, h = size
+    img = Image.new("RGBA", (w, h), (0, 0, 0, 0))
+    d = ImageDraw.Draw(img)
+    base = (40 + seed * 17 % 200, 80 + seed * 31 % 160, 120 + seed * 47 % 120, 255)
+    d.rounded_rectangle((10, 10, w - 10, h - 10), radius=60, fill=base)
+    for i in range(0, h, 24):
+        d.line((0, i, w, (i + seed * 13) % h), fill=(255, 255, 255, 160), width=5)
+    d.ellipse((w // 4, h // 4, w * 3 // 4, h // 2), fill=(250, 220, 120, 230))
+    img.save(path)
+
+
+def _make_pdf(path: str, title: str, pages: int = 1, image_path: str | None = None) -> None:
+    """それなりに描画命令のある1〜数ページのテンプレートPDF"""
+    c = canvas.Canvas(path, pagesize=PAGE_SIZE)
+    w, h = PAGE_SIZE
+    for p in range(pages):
+        c.setFillColorRGB(0.97, 0.94, 0.86)
+        c.rect(0, 0, w, h, stroke=0, fill=1)
+        c.setStrokeColorRGB(0.6, 0.45, 0.1)
+        for i in range(40):
+            c.line(20 + i * 23, 20, 40 + i * 21, h - 20)
+        c.setFillColorRGB(0.2, 0.15, 0.05)
+        c.setFont("Helvetica-Bold", 28)
+        c.drawString(40, h - 60, f"{title} ({p + 1}/{pages})")
+        c.setFont("Helvetica", 11)
+        for i in range(24):
+            c.drawString(40, h - 100 - i * 16, f"{title} line {i:02d} " + "lorem ipsum " * 6)
+        if image_path:
+            c.drawImage(ImageReader(image_path), w - 260, 40, width=200, height=260, mask="auto")
+        c.showPage()
+    c.save()
+
+
+def build_synthetic_assets(dest: str, font_path: str | None = None) -> str:
+    """dest に assets/ と同じ構成の合成ツリーを作って、そのパスを返す"""
+    fonts = os.path.join(dest, "fonts")
+    fixed = os.path.join(dest, "fixed")
+    kami = os.path.join(dest, "kami")
+    for d in (fonts, fixed, kami):
+        os.makedirs(d, exist_ok=True)
+
+    shutil.copyfile(font_path or _fallback_font(), os.path.join(fonts, "NotoSansJP-Regular.ttf"))
+
+    deco = os.path.join(dest, "_deco.png")
+    _make_photo(deco, 0, (300, 400))
+
+    for name in ["cover", "common02", "common03", "common11", "common16", "common29",
+                 "common_omake_04", "common_omake_05", "common_omake_06", "common_omake_07",
+                 "common_present01"]:
+        _make_pdf(os.path.join(fixed, f"{name}.pdf"), name, 1, deco)
+    _make_pdf(os.path.join(fixed, "common_omake01_03.pdf"), "common_omake01_03", 3, deco)
+
+    for no in range(1, KAMI_COUNT + 1):
+        folder = os.path.join(kami, str(no))
+        os.makedirs(os.path.join(folder, "p2"), exist_ok=True)
+        meta = {
+            "kami_name": f"Kami {no}",
+            "kami_kana": f"kami-{no}",
+            "shrines": [{"name": f"Shrine {no}-{i}", "pref": f"Pref {i}"} for i in range(3)],
+        }
+        with open(os.path.join(folder, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        _make_photo(os.path.join(folder, "photo.png"), no)
+        _make_pdf(os.path.join(folder, "p1.pdf"), f"kami{no} p1", 1, deco)
+        _make_pdf(os.path.join(folder, "p3.pdf"), f"kami{no} p3")
+        for role in ROLE_FILES:
+            _make_pdf(os.path.join(folder, role), f"kami{no} {role}")
+        for mask in range(1, 16):
+            _make_pdf(os.path.join(folder, "p2", f"mask_{mask}.pdf"), f"kami{no} mask{mask}")
+        _make_pdf(os.path.join(folder, "omake_month1.pdf"), f"kami{no} month1")
+        _make_pdf(os.path.join(folder, "omake_month23.pdf"), f"kami{no} month23", 2)
+
+    os.remove(deco)
+    return dest
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="合成アセットツリーを生成します")
+    ap.add_argument("dest", help="出力先ディレクトリ（assets/ 相当）")
+    ap.add_argument("--font", default=None, help="NotoSansJP の代わりに使う TTF（省略時は Vera.ttf）")
+    args = ap.parse_args(argv)
+    build_synthetic_assets(args.dest, args.font)
+    print("✅ 合成アセットを作成しました:", args.dest)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
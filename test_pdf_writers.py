@@ -0,0 +1,86 @@
+import io
+import importlib
+
+import pytest
+from pypdf import PdfReader
+
+pikepdf = pytest.importorskip("pikepdf")
+
+#---------------------------------------------------------
+# 自前の書き出し（linearize.py の線形化 / stream_writer.py の逐次書き出し）の検査
+#
+#   python -m pytest -q test_pdf_writers.py
+#
+# 合成アセット（synth_assets.py）で鑑定書を作り、ページ数・PDFの構文（qpdf）・線形化を確かめる。
+#---------------------------------------------------------
+
+BASE_PAYLOAD = {
+    "reader_name": "鑑定士",
+    "client_name": "山田",
+    "birthday": "1990-04-05",
+    "created": "2026-01-15",
+}
+
+CASES = {
+    "full": {"tenmei": 3, "syukumei": 5, "shimei": 3, "unmei": 7},
+    "course": {"tenmei": 1, "syukumei": 2, "shimei": 4, "unmei": 9, "include_course": True},
+    "single_god": {"tenmei": 6, "syukumei": 6, "shimei": 6, "unmei": 6, "include_bonus": False},
+}
+
+
+@pytest.fixture(scope="module")
+def build_pdf(tmp_path_factory):
+    """合成アセットを作り、それを読むように build_pdf を import する"""
+    from synth_assets import build_synthetic_assets
+
+    work = tmp_path_factory.mktemp("kami")
+    assets = build_synthetic_assets(str(work / "assets"))
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("KAMI_ASSETS_DIR", assets)
+        mp.setenv("KAMI_OUTPUTS_DIR", str(work / "outputs"))
+        import build_pdf
+        yield importlib.reload(build_pdf)
+
+
+def _expected_pages(build_pdf, parts: list) -> int:
+    return sum(len(PdfReader(build_pdf.open_asset(p)).pages) for p in parts)
+
+
+@pytest.mark.parametrize("linearize", [False, True], ids=["stream", "linearized"])
+@pytest.mark.parametrize("case", list(CASES))
+def test_written_pdf_is_valid(build_pdf, case, linearize):
+    payload = {**BASE_PAYLOAD, **CASES[case], "linearize": linearize}
+    parts = build_pdf.build_parts_from_payload(payload)
+    buf = io.BytesIO()
+    build_pdf.write_parts(parts, buf, payload)
+    data = buf.getvalue()
+
+    with pikepdf.open(io.BytesIO(data)) as pdf:
+        assert len(pdf.pages) == _expected_pages(build_pdf, parts)
+        assert pdf.check_pdf_syntax() == []
+        assert pdf.is_linearized == linearize
+        if linearize:
+            assert pdf.check_linearization()
+
+
+@pytest.mark.parametrize("case", list(CASES))
+def test_both_writers_give_same_pages(build_pdf, case):
+    texts = []
+    for linearize in (False, True):
+        data = build_pdf.build_pdf_bytes({**BASE_PAYLOAD, **CASES[case], "linearize": linearize})
+        texts.append([page.extract_text() for page in PdfReader(io.BytesIO(data)).pages])
+    assert texts[0] == texts[1]
+
+
+def test_cached_template_is_reused(build_pdf):
+    """固定パートは2件目からキャッシュのバイト列を使い、結果は変わらない"""
+    import stream_writer
+
+    payload = {**BASE_PAYLOAD, **CASES["full"]}
+    stream_writer.clear_template_cache()
+    first = build_pdf.build_pdf_bytes(payload)
+    assert len(stream_writer._cache) > 0
+    second = build_pdf.build_pdf_bytes(payload)
+    with pikepdf.open(io.BytesIO(second)) as pdf:
+        assert pdf.check_pdf_syntax() == []
+    assert len(PdfReader(io.BytesIO(first)).pages) == len(PdfReader(io.BytesIO(second)).pages)